@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import threading
+import weakref
+from collections.abc import Mapping
+
+import pygame
+
+
+def display_ready() -> bool:
+    return pygame.display.get_init() and pygame.display.get_surface() is not None
+
+
+def pack_shelves(sizes: list[tuple[int, int]], max_width: int, padding: int) -> tuple[list[tuple[int, int]], int, int]:
+    # Кадры кладутся на полки слева направо, от самых высоких к самым низким
+    positions: list[tuple[int, int]] = [(0, 0)] * len(sizes)
+    shelf_x, shelf_y, shelf_height, width = 0, 0, 0, 0
+    for i in sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0])):
+        frame_width, frame_height = sizes[i]
+        if shelf_x > 0 and shelf_x + frame_width > max_width:
+            shelf_x, shelf_y, shelf_height = 0, shelf_y + shelf_height + padding, 0
+        positions[i] = (shelf_x, shelf_y)
+        shelf_x += frame_width + padding
+        shelf_height = max(shelf_height, frame_height)
+        width = max(width, shelf_x - padding)
+    return positions, max(width, 1), max(shelf_y + shelf_height, 1)
+
+
+class Atlas(Mapping):
+    # Все кадры набора спрайтов на одной поверхности, atlas[key] - список кадров-подповерхностей.
+    # Поверхность переводится в формат экрана при первом обращении после создания окна
+    MAX_WIDTH = 2048
+    PADDING = 1
+    lock = threading.Lock()  # Оттенки и перевод формата нужны и главному потоку, и LevelPreloader
+
+    def __init__(self, frames: dict[str, list[pygame.Surface]]):
+        items = [(key, index, frame) for key, key_frames in frames.items() for index, frame in enumerate(key_frames)]
+        positions, width, height = pack_shelves([frame.get_size() for _, _, frame in items],
+                                                Atlas.MAX_WIDTH, Atlas.PADDING)
+
+        self.page = pygame.Surface((width, height), pygame.SRCALPHA)
+        self.regions: dict[str, list[pygame.Rect]] = {key: [] for key in frames.keys()}
+        for (key, index, frame), position in zip(items, positions):
+            # Копирование без смешивания, чтобы полупрозрачные пиксели остались как в исходной картинке
+            self.page.blit(frame, position, special_flags=pygame.BLEND_RGBA_MAX)
+            self.regions[key].append(pygame.Rect(position, frame.get_size()))
+
+        self.converted = False
+        self.frames: dict[str, list[pygame.Surface]] = dict()
+        # Оттенки живут, пока ими кто-то пользуется
+        self.tints: weakref.WeakValueDictionary[tuple[int, ...], Atlas] = weakref.WeakValueDictionary()
+
+    def convert(self):
+        with Atlas.lock:
+            if self.converted or not display_ready():
+                return
+            self.page = self.page.convert_alpha()
+            self.frames.clear()
+            self.converted = True
+
+    def tinted(self, color) -> Atlas:
+        # Цвет умножается на всю поверхность сразу, области кадров остаются теми же.
+        # Атлас общий для всех, кто попросил этот цвет, поэтому его кадры нельзя менять
+        color = tuple(color)
+        with Atlas.lock:
+            atlas = self.tints.get(color)
+            if atlas is not None:
+                return atlas
+            page, converted = self.page, self.converted
+
+        # Перекраска идёт без блокировки, если тот же цвет успели сделать в другом потоке, берём его
+        atlas = Atlas.__new__(Atlas)
+        atlas.page = page.copy()
+        atlas.page.fill(color[:3] + (255,), special_flags=pygame.BLEND_RGBA_MULT)
+        atlas.regions = self.regions
+        atlas.converted = converted
+        atlas.frames = dict()
+        atlas.tints = weakref.WeakValueDictionary()
+        with Atlas.lock:
+            existing = self.tints.get(color)
+            if existing is not None:
+                return existing
+            self.tints[color] = atlas
+        return atlas
+
+    def __getitem__(self, key: str) -> list[pygame.Surface]:
+        if not self.converted:
+            self.convert()
+        if key not in self.frames:
+            self.frames[key] = [self.page.subsurface(rect) for rect in self.regions[key]]
+        return self.frames[key]
+
+    def __iter__(self):
+        return iter(self.regions)
+
+    def __len__(self):
+        return len(self.regions)
+
+
+def load_frames(path: str, frame_width: int, frame_height: int, scale: int = 1) -> list[pygame.Surface]:
+    sprite_sheet = pygame.image.load(path)
+    frames = []
+    for i in range(sprite_sheet.get_width() // frame_width):
+        frame = sprite_sheet.subsurface((frame_width * i, 0), (frame_width, frame_height))
+        if scale != 1:
+            frame = pygame.transform.scale(frame, (frame_width * scale, frame_height * scale))
+        frames.append(frame)
+    return frames
+
+
+def add_flipped(frames: dict[str, list[pygame.Surface]], key: str, right_frames: list[pygame.Surface]):
+    frames[key + '_right'] = right_frames
+    frames[key + '_left'] = [pygame.transform.flip(frame, True, False) for frame in right_frames]
@@ -0,0 +1,77 @@
+"""Blit throughput of game sprites: frames as loaded from disk vs frames from converted atlases.
+
+Runs without a window using the SDL dummy video driver:
+    python benchmarks/blit_benchmark.py [--frames N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame
+
+from assets import Atlas, add_flipped, load_frames
+from config import WIDTH, HEIGHT
+
+
+def load_sources() -> dict[str, list[pygame.Surface]]:
+    frames: dict[str, list[pygame.Surface]] = dict()
+    path = os.path.join('data', 'PlayerSprites', 'Knight')
+    for filename in os.listdir(path):
+        if filename.endswith('.png'):
+            add_flipped(frames, 'Knight_' + filename.replace('.png', ''), load_frames(os.path.join(path, filename), 64, 64))
+    path = os.path.join('data', 'WeaponSprites')
+    for directory in os.listdir(path):
+        for filename in os.listdir(os.path.join(path, directory)):
+            if filename.endswith('.png'):
+                sheet = pygame.image.load(os.path.join(path, directory, filename))
+                # Кадры оружия разного размера, для замера достаточно нарезать лист по высоте
+                add_flipped(frames, f'{directory}_{filename}', load_frames(os.path.join(path, directory, filename),
+                                                                            sheet.get_height(), sheet.get_height()))
+    return frames
+
+
+def measure(target: pygame.Surface, sprites: list[pygame.Surface], frames: int, per_frame: int) -> float:
+    rng = random.Random(1)
+    positions = [(rng.randrange(target.get_width()), rng.randrange(target.get_height())) for _ in range(per_frame)]
+    start = time.perf_counter()
+    for frame in range(frames):
+        target.fill((0, 0, 0))
+        for i, position in enumerate(positions):
+            target.blit(sprites[(i + frame) % len(sprites)], position)
+    return frames * per_frame / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--sprites-per-frame', type=int, default=200)
+    args = parser.parse_args()
+
+    pygame.init()
+    pygame.display.set_mode((WIDTH, HEIGHT))
+    target = pygame.Surface((WIDTH // 2, HEIGHT // 2)).convert()
+
+    sources = load_sources()
+    atlas = Atlas(sources)
+    tinted = atlas.tinted((64, 128, 255))
+    cases = {
+        'loaded': [frame for key_frames in sources.values() for frame in key_frames],
+        'atlas': [frame for key in atlas for frame in atlas[key]],
+        'atlas_tinted': [frame for key in tinted for frame in tinted[key]],
+    }
+
+    print(f'{sum(map(len, sources.values()))} frames, atlas page {atlas.page.get_size()}')
+    for name, sprites in cases.items():
+        rate = measure(target, sprites, args.frames, args.sprites_per_frame)
+        print(f'{name:>14}: {rate / 1000:8.1f}k blits/s')
+
+
+if __name__ == '__main__':
+    main()
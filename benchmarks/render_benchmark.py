@@ -0,0 +1,264 @@
+"""Frame time of Game.update and Game.draw split by section (physics, collision, level, entities, scale, hud).
+
+Runs without a window using the SDL dummy video driver. Scenes are either synthetic, with N players,
+M bullets and K weapons on every level in data/levels, or a session recorded with APP.RECORD_TRAFFIC
+in config.yaml. Results are written as JSON and two runs can be compared:
+    python benchmarks/render_benchmark.py [--players N] [--bullets M] [--weapons K] [--output run.json]
+    python benchmarks/render_benchmark.py --replay session.jsonl [--output run.json]
+    python benchmarks/render_benchmark.py --compare old.json new.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from collections import deque
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame
+
+from config import WIDTH, HEIGHT
+from frame_profiler import FrameProfiler, frame_profiler
+from network import DataPacket, coalesce
+
+SECTIONS = ['frame'] + FrameProfiler.SECTIONS
+FRAME_TIME = 1 / 60
+
+
+class FixedClock:
+    # Game берёт время кадра из часов, в замере оно всегда одно и то же
+    def get_fps(self):
+        return 1 / FRAME_TIME
+
+    def get_time(self):
+        return FRAME_TIME * 1000
+
+    def tick(self, framerate=0):
+        return int(FRAME_TIME * 1000)
+
+
+class ReplayNetwork:
+    # Отдаёт записанные пакеты в callback по времени их приёма, отправка ничего не делает
+    def __init__(self, records: list, callback):
+        self.records = records
+        self.callback = callback
+        self.position = 0
+        self.time = 0
+        self.id = -1
+        self.udp_packets_received = 0
+        self.packets_received = 0
+        self.packets_coalesced = 0
+
+    def finished(self) -> bool:
+        return self.position >= len(self.records)
+
+    def receive(self) -> bool:
+        # Как и Network.receive, отдаёт пачку пакета за кадр без устаревших пакетов состояния
+        batch = []
+        while self.position < len(self.records) and self.records[self.position][0] <= self.time:
+            _, data_type, data, headers = self.records[self.position]
+            self.position += 1
+            batch.append((DataPacket(data_type, data, headers),))
+        kept = coalesce(batch)
+        for data_packet, in kept:
+            self.callback(data_packet, None)
+        self.packets_received += len(batch)
+        self.packets_coalesced += len(batch) - len(kept)
+        frame_profiler.count('packets', len(batch))
+        frame_profiler.count('coalesced', len(batch) - len(kept))
+        self.time += FRAME_TIME
+        return bool(batch)
+
+    def send_tcp(self, data_packet):
+        pass
+
+    def send_udp(self, data_packet):
+        pass
+
+
+def level_names() -> list[str]:
+    path = os.path.join('data', 'levels')
+    return sorted(name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name)))
+
+
+def synthetic_scene(main, game_manager, level_name: str, players: int, weapons: int, seed: int):
+    from player import Player
+    from weapon import Weapon
+
+    rng = random.Random(seed)
+    level = main.Level(level_name)
+    points = level.objects['points']
+    spawn_points = [(point.x, point.y) for point in points if point.name == 'spawnpoint'] or [(0, 0)]
+    weapon_points = [(point.x, point.y) for point in points if 'Weapon' in point.name] or spawn_points
+
+    game = main.Game(main.clock, game_manager, level_name, spawn_points[0], level)
+    for player_id in range(1, players + 1):
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        player = Player((0, 0), 1, "Knight", color)
+        x, y = rng.choice(spawn_points)
+        player.set_right(x + rng.randrange(-64, 64))
+        player.set_top(y)
+        game.players[player_id] = player
+
+    names = [name for name in Weapon.all_weapons_info.keys() if name != 'WeaponNone']
+    for weapon_id in range(weapons):
+        x, y = weapon_points[weapon_id % len(weapon_points)]
+        game.weapons[weapon_id] = Weapon(name=rng.choice(names), pos=(x + rng.randrange(-32, 32), y - 32))
+        game.wake_weapon(weapon_id)
+    return game, spawn_points
+
+
+def refill_bullets(game, rng: random.Random, bullets: int, next_bullet_id: int) -> int:
+    from weapon import Bullet
+
+    shooters = [game.player] + list(game.players.values())
+    while len(game.bullets) < bullets:
+        x, y = rng.choice(shooters).get_center_position()
+        speed = (rng.choice((-1, 1)) * rng.randrange(600, 1200), rng.uniform(-100, 100))
+        game.bullets[next_bullet_id] = Bullet((x, y - 16), speed, 10, 0)
+        next_bullet_id += 1
+    return next_bullet_id
+
+
+def summarize(profiler: FrameProfiler) -> dict:
+    sections = dict()
+    for name in SECTIONS:
+        sections[name] = {key: round(value * 1000, 4) for key, value in profiler.summary(name).items()}
+    counters = {name: sum(profiler.samples(name)) for name in FrameProfiler.COUNTERS}
+    return {'frames': len(profiler.frames), 'sections': sections, 'counters': counters}
+
+
+def run_synthetic(main, screen, args) -> dict:
+    results = dict()
+    for level_name in args.levels or level_names():
+        game_manager = main.GameManager()
+        game_manager.disconnected = True
+        game_manager.packet_received = False  # Чужие игроки двигаются и сталкиваются с уровнем сами
+        game_manager.network = ReplayNetwork([], game_manager.callback)
+        game, spawn_points = synthetic_scene(main, game_manager, level_name, args.players, args.weapons, args.seed)
+        game_manager.game = game
+
+        rng = random.Random(args.seed)
+        next_bullet_id = 0
+        frame_profiler.clear()
+        for frame in range(args.warmup + args.frames):
+            if frame == args.warmup:
+                frame_profiler.clear()
+            if frame % args.teleport_every == 0:
+                # Камера переезжает к другой точке, чтобы в замер попадала подготовка новых чанков
+                x, y = spawn_points[frame // args.teleport_every % len(spawn_points)]
+                game.player.set_right(x)
+                game.player.set_top(y)
+            next_bullet_id = refill_bullets(game, rng, args.bullets, next_bullet_id)
+
+            frame_profiler.begin_frame()
+            game.draw(screen)
+            frame_profiler.end_frame()
+
+        results[level_name] = summarize(frame_profiler)
+        print_scene(level_name, results[level_name])
+    return results
+
+
+def run_replay(main, screen, args) -> dict:
+    with open(args.replay) as file:
+        records = [json.loads(line) for line in file if line.strip()]
+    game_manager = main.GameManager()
+    game_manager.network = ReplayNetwork(records, game_manager.callback)
+    game_manager.disconnected = False
+
+    frame_profiler.clear()
+    frame = 0
+    while not game_manager.network.finished():
+        if frame == args.warmup:
+            frame_profiler.clear()
+        frame_profiler.begin_frame()
+        game_manager.draw(screen)
+        frame_profiler.end_frame()
+        frame += 1
+
+    name = os.path.basename(args.replay)
+    results = {name: summarize(frame_profiler)}
+    print_scene(name, results[name])
+    return results
+
+
+def print_scene(name: str, result: dict):
+    print(f'{name}: {result["frames"]} frames')
+    if result['counters']['packets']:
+        print(f'  packets {result["counters"]["packets"]}, coalesced {result["counters"]["coalesced"]}')
+    for section, values in result['sections'].items():
+        if values['max'] == 0:
+            continue
+        print(f'  {section:>9}: p50 {values["p50"]:7.3f} ms  p90 {values["p90"]:7.3f} ms  '
+              f'p99 {values["p99"]:7.3f} ms  max {values["max"]:7.3f} ms')
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as file:
+        old = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+
+    for scene in sorted(old['scenes'].keys() & new['scenes'].keys()):
+        print(scene)
+        old_sections, new_sections = old['scenes'][scene]['sections'], new['scenes'][scene]['sections']
+        for section in SECTIONS:
+            if section not in old_sections or section not in new_sections:
+                continue
+            line = f'  {section:>9}:'
+            for key in ('p50', 'p90', 'p99'):
+                before, after = old_sections[section][key], new_sections[section][key]
+                change = (after - before) / before * 100 if before else 0
+                line += f'  {key} {before:7.3f} -> {after:7.3f} ms ({change:+6.1f}%)'
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--bullets', type=int, default=40)
+    parser.add_argument('--weapons', type=int, default=6)
+    parser.add_argument('--frames', type=int, default=600)
+    parser.add_argument('--warmup', type=int, default=30)
+    parser.add_argument('--teleport-every', type=int, default=120)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--levels', nargs='*')
+    parser.add_argument('--replay')
+    parser.add_argument('--output')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    pygame.init()
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+
+    import main as game_main
+    game_main.clock = FixedClock()
+    frame_profiler.enabled = True
+    frame_profiler.frames = deque()  # Храним все кадры замера
+
+    if args.replay:
+        scenes = run_replay(game_main, screen, args)
+    else:
+        scenes = run_synthetic(game_main, screen, args)
+
+    if args.output:
+        result = {'version': 1,
+                  'pygame': pygame.version.ver,
+                  'resolution': [WIDTH, HEIGHT],
+                  'args': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+                  'scenes': scenes}
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,9 @@ with open("config.yaml", "r") as stream:
         FULLSCREEN = data['APP']['FULLSCREEN']
         WEBCAM = data['APP']['WEBCAM']
         WEBCAM_SERVER_PORT = data['APP']['WEBCAM_SERVER_PORT']
+        PROFILE_STARTUP = data['APP']['PROFILE_STARTUP']
+        RECORD_TRAFFIC = data['APP']['RECORD_TRAFFIC']  # Путь к файлу для записи принятых пакетов
+        PLAYER_INFO_RATE = data['APP']['PLAYER_INFO_RATE']  # Отправок состояния игрока на сервер в секунду
     except yaml.YAMLError as exc:
         print(exc)
 
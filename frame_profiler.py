@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import csv
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class FrameProfiler:
+    # Время участков кадра в секундах. Пока профилировщик выключен, section почти ничего не стоит.
+    # Вложенные участки вычитаются из внешнего, поэтому участки кадра не пересекаются
+    HISTORY = 600
+    SECTIONS = ['network', 'callbacks', 'physics', 'collision', 'level', 'entities', 'scale', 'hud', 'overlay', 'flip']
+    COUNTERS = ['packets', 'coalesced']  # Не время, а количество за кадр
+
+    def __init__(self, history: int | None = HISTORY):
+        self.enabled = False
+        self.frames: deque[dict[str, float]] = deque(maxlen=history)
+        self.current: dict[str, float] = dict()
+        self.children_time: list[float] = []
+        self.frame_start = perf_counter()
+
+    def begin_frame(self):
+        self.current = dict()
+        self.children_time = []
+        self.frame_start = perf_counter()
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        self.current['frame'] = perf_counter() - self.frame_start
+        self.frames.append(self.current)
+
+    @contextmanager
+    def section(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        self.children_time.append(0)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            total = perf_counter() - start
+            children = self.children_time.pop()
+            if self.children_time:
+                self.children_time[-1] += total
+            self.current[name] = self.current.get(name, 0) + total - children
+
+    def count(self, name: str, value: int = 1):
+        if self.enabled:
+            self.current[name] = self.current.get(name, 0) + value
+
+    def clear(self):
+        self.frames.clear()
+        self.current = dict()
+
+    def export_csv(self, path: str):
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['index'] + [f'{name}_ms' for name in ['frame'] + FrameProfiler.SECTIONS] +
+                            FrameProfiler.COUNTERS)
+            for index, frame in enumerate(self.frames):
+                writer.writerow([index] + [round(frame.get(name, 0) * 1000, 4)
+                                           for name in ['frame'] + FrameProfiler.SECTIONS] +
+                                [frame.get(name, 0) for name in FrameProfiler.COUNTERS])
+
+    def samples(self, name: str) -> list[float]:
+        return [frame.get(name, 0) for frame in self.frames]
+
+    def summary(self, name: str) -> dict[str, float]:
+        values = sorted(self.samples(name))
+        if not values:
+            return {'mean': 0, 'p50': 0, 'p90': 0, 'p99': 0, 'max': 0}
+        return {'mean': sum(values) / len(values),
+                'p50': percentile(values, 50),
+                'p90': percentile(values, 90),
+                'p99': percentile(values, 99),
+                'max': values[-1]}
+
+
+frame_profiler = FrameProfiler()
@@ -1,8 +1,11 @@
+import time
+
 import pygame
 import pyperclip
+from frame_profiler import FrameProfiler
 from sound import SoundCore
 from weapon import Weapon
-from config import WIDTH, HEIGHT
+from config import WIDTH, HEIGHT, MAX_FPS
 
 RED = (255, 0, 0)
 GRAY = (125, 125, 125)
@@ -311,3 +314,105 @@ class PlayerStat:
         self.hp_bar.draw(screen)
         self.ammo_bar.draw(screen, color)
 
+
+class FrameTimeOverlay:
+    # F3 - показать или скрыть, F4 - сохранить историю кадров в csv.
+    # Профилировщик работает только пока оверлей открыт
+    REFRESH_TIME = 0.5  # Перцентили пересчитываются не каждый кадр
+    POSITION = (8, 8)
+    GRAPH_HEIGHT = 80
+    GRAPH_MAX_MS = 50
+    TARGET_MS = 1000 / MAX_FPS if MAX_FPS else 0  # Без ограничения fps линии цели нет
+    BACKGROUND = (0, 0, 0, 170)
+
+    def __init__(self, profiler: FrameProfiler):
+        self.profiler = profiler
+        self.visible = False
+        self.font = None
+        self.text_surface: pygame.Surface = None
+        self.graph: pygame.Surface = None  # Фон графика создаётся заново, только когда меняется ширина
+        self.last_refresh = 0
+        self.message = ''
+
+    def toggle(self):
+        self.visible = not self.visible
+        self.profiler.enabled = self.visible
+        self.profiler.clear()
+        if self.visible and self.font is None:
+            self.font = pygame.font.SysFont('monospace', 14)
+
+    def export(self):
+        path = time.strftime('frame_times_%Y%m%d_%H%M%S.csv')
+        try:
+            self.profiler.export_csv(path)
+            self.message = f'saved {path}'
+        except OSError as e:
+            self.message = str(e)
+        self.last_refresh = 0
+
+    def event_handle(self, event):
+        if event.type != pygame.KEYDOWN:
+            return
+        if event.key == pygame.K_F3:
+            self.toggle()
+        if event.key == pygame.K_F4 and self.visible:
+            self.export()
+
+    def refresh(self):
+        # Колонки выравниваются по пикселям, моноширинного шрифта в системе может не быть
+        columns = ('p50', 'p90', 'p99', 'max')
+        rows = [['ms'] + list(columns)]
+        for name in ['frame'] + FrameProfiler.SECTIONS:
+            summary = self.profiler.summary(name)
+            rows.append([name] + [f'{summary[key] * 1000:.2f}' for key in columns])
+        for name in FrameProfiler.COUNTERS:
+            summary = self.profiler.summary(name)
+            rows.append([name] + [f'{summary[key]:.0f}' for key in columns])
+
+        line_height = self.font.get_linesize()
+        name_width = max(self.font.size(row[0])[0] for row in rows) + 8
+        column_width = self.font.size('000.00')[0] + 8
+        width = name_width + column_width * len(columns) + 8
+        lines = len(rows) + (1 if self.message else 0)
+        self.text_surface = pygame.Surface((width, line_height * lines + 8), pygame.SRCALPHA)
+        self.text_surface.fill(FrameTimeOverlay.BACKGROUND)
+        for i, row in enumerate(rows):
+            y = 4 + i * line_height
+            self.text_surface.blit(self.font.render(row[0], True, (255, 255, 255)), (4, y))
+            for j, cell in enumerate(row[1:]):
+                cell_surface = self.font.render(cell, True, (255, 255, 255))
+                right = 4 + name_width + column_width * (j + 1)
+                self.text_surface.blit(cell_surface, (right - cell_surface.get_width(), y))
+        if self.message:
+            self.text_surface.blit(self.font.render(self.message, True, YELLOW), (4, 4 + len(rows) * line_height))
+        self.last_refresh = time.time()
+
+    def draw(self, screen: pygame.Surface):
+        if not self.visible:
+            return
+        if time.time() - self.last_refresh > FrameTimeOverlay.REFRESH_TIME:
+            self.refresh()
+
+        x, y = FrameTimeOverlay.POSITION
+        screen.blit(self.text_surface, (x, y))
+
+        # График времени кадра, последний кадр справа
+        width = self.text_surface.get_width()
+        top = y + self.text_surface.get_height() + 4
+        bottom = top + FrameTimeOverlay.GRAPH_HEIGHT
+        if self.graph is None or self.graph.get_width() != width:
+            self.graph = pygame.Surface((width, FrameTimeOverlay.GRAPH_HEIGHT), pygame.SRCALPHA)
+            self.graph.fill(FrameTimeOverlay.BACKGROUND)
+        screen.blit(self.graph, (x, top))
+
+        scale = FrameTimeOverlay.GRAPH_HEIGHT / FrameTimeOverlay.GRAPH_MAX_MS
+        if FrameTimeOverlay.TARGET_MS:
+            target_y = bottom - FrameTimeOverlay.TARGET_MS * scale
+            pygame.draw.line(screen, YELLOW, (x, target_y), (x + width - 1, target_y))
+
+        samples = self.profiler.samples('frame')[-width:]
+        if len(samples) > 1:
+            offset = x + width - len(samples)
+            points = [(offset + i, bottom - min(FrameTimeOverlay.GRAPH_HEIGHT, value * 1000 * scale))
+                      for i, value in enumerate(samples)]
+            pygame.draw.lines(screen, GREEN, False, points)
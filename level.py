@@ -1,99 +1,44 @@
+import math
 import os
-import xml.etree.ElementTree as ET
-from fnmatch import fnmatch
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import Future
 from typing import Protocol
 
+import numpy as np
 import pygame
 
+from assets import display_ready
 from config import WIDTH, HEIGHT
+from level_compiler import load_compiled, source_files
 
 
 def load_map(name: str):
-    path = os.path.join("data", "levels", name)
+    description, layers_chunks, tileset_data = load_compiled(name)
+    info = description['info']
+    tilewidth, tileheight = info['tile_width'], info['tile_height']
 
-    map_xml = None
-    for filename in os.listdir(path):
-        if fnmatch(filename, '*.tmx'):
-            map_xml = ET.parse(os.path.join(path, filename))
-
-    if map_xml is None:
-        raise Exception
-
-    map_xml_root = map_xml.getroot()
-
-    tileset_source = os.path.join(path, map_xml_root.find('tileset').get('source'))
-    tileset_xml = ET.parse(tileset_source)
-    tileset_xml_root = tileset_xml.getroot()
-
-    tilewidth = int(tileset_xml_root.get('tilewidth'))
-    tileheight = int(tileset_xml_root.get('tileheight'))
-    image_source = os.path.join(path, tileset_xml_root.find('image').get('source'))
-    image = pygame.image.load(image_source)
+    # Картинки тайлов ссылаются на память скомпилированного файла, копирования не происходит
+    tile_count = description['tileset']['tile_count']
+    tileset = pygame.image.frombuffer(tileset_data, (tilewidth, tileheight * tile_count), 'RGBA')
     tiles_images: list[pygame.Surface] = []
-
-    animations: dict[int, int] = dict()  # Какая картинка следует за текущей
-
-    for tile in tileset_xml_root.findall('tile'):
-        tile_id = int(tile.get('id'))
-        next_tile_id = int(tile.find('properties').find('property').get('value'))
-        animations[tile_id] = next_tile_id
-
-    for i in range(image.get_height() // tileheight):
-        for j in range(image.get_width() // tilewidth):
-            tiles_images.append(image.subsurface(j * tilewidth, i * tileheight, tilewidth, tileheight))
+    for i in range(tile_count):
+        tiles_images.append(tileset.subsurface(0, i * tileheight, tilewidth, tileheight))
     tiles_images.append(pygame.Surface((tilewidth, tileheight)))  # Последний тайл (с id = -1) прозрачный
     tiles_images[-1].set_colorkey((0, 0, 0))
 
-    Tile.tile_images = tiles_images
-    Tile.animations = animations
-
-    map_width = int(map_xml_root.get('width'))
-    map_height = int(map_xml_root.get('height'))
-    scale = int(map_xml_root.find('properties').find('property').get('value'))
-    layers: list[Layer] = []
-    animated_tiles: list[Tile] = []
-
-    for layer in map_xml_root.findall('layer'):
-        tiles: list[Tile] = []
-        data = layer.find('data').text
-        tile_ids = list(map(int, data.split(',')))
-        has_collision = True if (layer.find('properties').find('property').get('value') == 'true') else False
-        for i, tile_id in enumerate(tile_ids):
-            tile_x = i % map_width
-            tile_y = i // map_width
-            tile = Tile(tilewidth * tile_x, tileheight * tile_y, tilewidth, tileheight,
-                        tile_id, tile_id - 1, has_collision)
-            tile.animated = (tile.image_id in animations.keys())
-            animated_tiles.append(tile)
-            tiles.append(tile)
-        layers.append(Layer(has_collision, tiles))
+    animations = {int(tile_id): next_tile_id for tile_id, next_tile_id in description['animations'].items()}
+
+    # Чанки слоёв - это память скомпилированного файла, массивы id создаются при загрузке чанка
+    layers = [Layer(layer_info['has_collision'], chunks, description['chunk_tiles'])
+              for layer_info, chunks in zip(description['layers'], layers_chunks)]
 
     objects = dict()
-    objects['rectangles'], objects['points'] = [], []
-    for objectgroup in map_xml_root.findall('objectgroup'):
-        for game_object in objectgroup.findall('object'):
-            object_name = game_object.get('name')
-            if game_object.find('point') is not None:
-                x, y = game_object.get('x'), game_object.get('y')
-                objects['points'].append(GameObjectPoint(int(float(x)), int(float(y)), object_name))
-            elif game_object.find('ellipse') is not None:
-                pass
-            elif game_object.find('polygon') is not None:
-                pass
-            else:
-                x, y = game_object.get('x'), game_object.get('y')
-                width, height = game_object.get('width'), game_object.get('height')
-                objects['rectangles'].append(
-                    GameObjectRect(int(float(x)), int(float(y)), int(float(width)), int(float(height)), object_name))
+    objects['rectangles'] = [GameObjectRect(*rectangle) for rectangle in description['objects']['rectangles']]
+    objects['points'] = [GameObjectPoint(*point) for point in description['objects']['points']]
 
-    info = dict()
-    info['name'] = name
-    info['scale'] = scale
-    info['width'] = map_width
-    info['height'] = map_height
-    info['tile_width'] = tilewidth
-    info['tile_height'] = tileheight
-    return layers, objects, info, animated_tiles
+    return layers, objects, dict(info), tileset, tiles_images, animations
 
 
 class Collidable(Protocol):
@@ -102,74 +47,392 @@ class Collidable(Protocol):
 
 
 class Level:
+    # Лимиты подгружаемых чанков: сетки id с зарегистрированными анимациями и запечённые поверхности в пикселях
+    MAX_LOADED_CHUNKS = 1024
+    MAX_BAKED_PIXELS = 16 * 1024 * 1024
+    PREFETCH_BAKES = 1  # Сколько чанков вокруг экрана запекается заранее за кадр
+
     def __init__(self, name: str):
-        self.layers, self.objects, self.info, self.animated_tiles = load_map(name)
+        self.layers, self.objects, self.info, self.tileset, self.tiles_images, self.animations = load_map(name)
+        self.tileset_converted = False
         self.scale = self.info['scale']
         self.radius = 500
+        self.changed_rects: list[pygame.Rect] = []  # Твёрдые тайлы, изменившиеся при последнем update
+        self.collision_layers = [layer for layer in self.layers if layer.has_collision]
+        for index, layer in enumerate(self.layers):
+            layer.level, layer.index = self, index
+
+        self.tile_width, self.tile_height = self.info['tile_width'], self.info['tile_height']
+        self.chunk_tiles = self.layers[0].chunk_tiles if self.layers else 1
+        self.chunk_width, self.chunk_height = self.chunk_tiles * self.tile_width, self.chunk_tiles * self.tile_height
+        self.chunk_keys = set(key for layer in self.layers for key in layer.chunks.keys())
+
+        # Типы тайлов и анимации создаются, когда загружается первый использующий их чанк
+        self.tile_types: list[TileType | None] = [None] * len(self.tiles_images)
+        self.sequences: dict[int, AnimationSequence] = dict()  # Одна последовательность на каждую начальную картинку
+        self.animation_time = 0  # Общие часы анимаций, по ним и поздно созданная последовательность идёт в фазе
+
+        self.loaded_chunks: OrderedDict[tuple[int, int], LevelChunk] = OrderedDict()
+        self.baked_chunks: OrderedDict[tuple[int, int], LevelChunk] = OrderedDict()
+        self.baked_pixels = 0
+
+    def reset(self):
+        # Состояние игры на уровне: анимации начинаются заново, как у только что загруженного
+        self.animation_time = 0
+        self.changed_rects.clear()
+        for sequence in self.sequences.values():
+            sequence.update(self.animation_time)
+
+    def tile_type(self, tile_id: int) -> 'TileType':
+        if self.tile_types[tile_id] is None:
+            sequence = None
+            if tile_id - 1 in self.animations.keys():
+                if tile_id - 1 not in self.sequences.keys():
+                    self.sequences[tile_id - 1] = AnimationSequence(tile_id - 1, self.animations, self.tiles_images)
+                    self.sequences[tile_id - 1].update(self.animation_time)
+                sequence = self.sequences[tile_id - 1]
+            self.tile_types[tile_id] = TileType(tile_id, tile_id - 1, self.tiles_images, sequence)
+        return self.tile_types[tile_id]
+
+    def get_chunk(self, key: tuple[int, int]) -> 'LevelChunk | None':
+        chunk = self.loaded_chunks.get(key)
+        if chunk is not None:
+            self.loaded_chunks.move_to_end(key)
+            return chunk
+        if key not in self.chunk_keys:
+            return None
+
+        chunk = LevelChunk(self, key)
+        self.loaded_chunks[key] = chunk
+        while len(self.loaded_chunks) > Level.MAX_LOADED_CHUNKS:
+            self.unload_chunk(next(iter(self.loaded_chunks.keys())))
+        return chunk
+
+    def unload_chunk(self, key: tuple[int, int]):
+        chunk = self.loaded_chunks.pop(key)
+        self.drop_surface(chunk)
+        chunk.unload()
+
+    def drop_surface(self, chunk: 'LevelChunk'):
+        if chunk.surface is not None:
+            self.baked_chunks.pop(chunk.key)
+            self.baked_pixels -= chunk.surface.get_width() * chunk.surface.get_height()
+            chunk.surface = None
+
+    def bake_chunk(self, chunk: 'LevelChunk', keep: set[tuple[int, int]]):
+        chunk.bake()
+        self.baked_chunks[chunk.key] = chunk
+        self.baked_pixels += chunk.surface.get_width() * chunk.surface.get_height()
+        # Чанки на экране не выбрасываются, даже если лимит превышен
+        for key in [key for key in self.baked_chunks.keys() if key not in keep]:
+            if self.baked_pixels <= Level.MAX_BAKED_PIXELS:
+                break
+            self.drop_surface(self.baked_chunks[key])
+
+    def convert_tileset(self):
+        # Картинки тайлов переводятся в формат экрана на месте, типы тайлов ссылаются на тот же список
+        if self.tileset_converted or not display_ready():
+            return
+        self.tileset = self.tileset.convert_alpha()
+        for i in range(len(self.tiles_images) - 1):
+            self.tiles_images[i] = self.tileset.subsurface(0, i * self.tile_height, self.tile_width, self.tile_height)
+        self.tileset_converted = True
+
+    def chunk_keys_in(self, rect: pygame.Rect, margin=0) -> list[tuple[int, int]]:
+        return [(j, i)
+                for i in range(rect.top // self.chunk_height - margin, (rect.bottom - 1) // self.chunk_height + margin + 1)
+                for j in range(rect.left // self.chunk_width - margin, (rect.right - 1) // self.chunk_width + margin + 1)]
+
+    def load_around(self, points, radius):
+        # Держит загруженными чанки рядом с точками, остальные выгружаются, когда кончается лимит
+        for x, y in points:
+            for key in self.chunk_keys_in(pygame.Rect(x - radius, y - radius, 2 * radius, 2 * radius)):
+                self.get_chunk(key)
 
     def draw(self, screen: pygame.Surface, offset_x, offset_y, pos_x, pos_y):
-        visible_tiles = self.get_visible_tiles(offset_x, offset_y)
-        for layer in self.layers:
-            for tile_number in visible_tiles:
-                tile = layer.tiles[tile_number]
-                tile.draw(screen, offset_x, offset_y, self.scale)
+        self.convert_tileset()
+        view = pygame.Rect(-offset_x, -offset_y, screen.get_width(), screen.get_height())
+        keys = self.chunk_keys_in(view)
+        chunks = [chunk for chunk in map(self.get_chunk, keys) if chunk is not None]
+
+        for chunk in chunks:
+            if chunk.surface is None:
+                self.bake_chunk(chunk, set(keys))
+            self.baked_chunks.move_to_end(chunk.key)
+            screen.blit(chunk.surface, (chunk.key[0] * self.chunk_width + offset_x,
+                                        chunk.key[1] * self.chunk_height + offset_y))
+
+        for chunk in chunks:
+            for tile in chunk.overlay_tiles:
+                if view.colliderect(tile.rect):
+                    tile.draw(screen, offset_x, offset_y, self.scale)
+
+        # Чанки рядом с экраном запекаются заранее, по несколько за кадр
+        bakes = 0
+        for key in self.chunk_keys_in(view, margin=1):
+            if bakes >= Level.PREFETCH_BAKES:
+                break
+            chunk = self.get_chunk(key)
+            if chunk is not None and chunk.surface is None:
+                self.bake_chunk(chunk, set(keys))
+                bakes += 1
+
+    def solid_rects(self, area: pygame.Rect) -> list[pygame.Rect]:
+        rects = []
+        for key in self.chunk_keys_in(area):
+            chunk = self.get_chunk(key)
+            if chunk is None:
+                continue
+            rects.extend(chunk.solid_rects[i] for i in area.collidelistall(chunk.solid_rects))
+            for sequence, x, y in chunk.animated_solids:
+                rect = sequence.bounding_rect.move(x, y)
+                if rect.width and area.colliderect(rect):
+                    rects.append(rect)
+        return rects
+
+    def solid_rects_around(self, box, dx, dy) -> list[pygame.Rect]:
+        # Прямоугольники, которых box может коснуться при сдвиге на (dx, dy), box - (x, y, width, height), можно дробные
+        x, y, width, height = box
+        area = pygame.Rect(math.floor(min(x, x + dx)) - 1, math.floor(min(y, y + dy)) - 1,
+                           math.ceil(width + abs(dx)) + 3, math.ceil(height + abs(dy)) + 3)
+        return self.solid_rects(area)
+
+    def sweep(self, box, dx, dy):
+        return sweep_aabb(box, dx, dy, self.solid_rects_around(box, dx, dy))
 
     def update(self, time_delta):
-        for tile in self.animated_tiles:
-            tile.update(time_delta)
-
-    def get_visible_tiles(self, offset_x, offset_y):
-        tile_numbers = []
-        i_start = int(max(0, -offset_y // (self.info['tile_height'])))
-        j_start = int(max(0, -offset_x // (self.info['tile_width'])))
-        i_end = int(min(self.info['height'], i_start + HEIGHT // (self.info['tile_height'] * self.scale) + 2))
-        j_end = int(min(self.info['width'], j_start + WIDTH // (self.info['tile_width'] * self.scale) + 2))
-        for i in range(i_start, i_end):
-            for j in range(j_start, j_end):
-                tile_number = int(i * self.info['width'] + j)
-                tile_numbers.append(tile_number)
-        return tile_numbers
+        self.changed_rects.clear()
+        self.animation_time += time_delta
+        for sequence in self.sequences.values():
+            if sequence.update(self.animation_time) and sequence.changes_collision:
+                self.changed_rects.extend(sequence.collision_rects)
 
     def collide_sprite(self, sprite: Collidable):
         collided = []
         rect = sprite.rect
-        for layer in self.layers:
-            if not layer.has_collision:
-                continue
-            for i in range(self.info['height']):
-                for j in range(self.info['width']):
-                    tile = layer.tiles[i * self.info['width'] + j]
-                    if tile.rect.bottom <= rect.top:
-                        break
-                    if tile.rect.top >= rect.bottom:
-                        return collided
-
-                    if tile.rect.right <= rect.left:
-                        continue
-                    if tile.rect.left >= rect.right:
-                        break
-
-                    if tile.tile_id == 0:
-                        continue
-                    if pygame.sprite.collide_mask(tile, sprite):
-                        collided.append(tile)
+        for layer in self.collision_layers:
+            for key in self.chunk_keys_in(rect):
+                chunk = self.get_chunk(key)
+                if chunk is None or chunk.grids[layer.index] is None:
+                    continue
+                # Проверяются только клетки под прямоугольником спрайта
+                chunk_left, chunk_top = key[0] * self.chunk_tiles, key[1] * self.chunk_tiles
+                top = max(0, rect.top // self.tile_height - chunk_top)
+                bottom = min(self.chunk_tiles, (rect.bottom - 1) // self.tile_height + 1 - chunk_top)
+                left = max(0, rect.left // self.tile_width - chunk_left)
+                right = min(self.chunk_tiles, (rect.right - 1) // self.tile_width + 1 - chunk_left)
+                area = chunk.grids[layer.index][top:bottom, left:right]
+                for y, x in zip(*np.nonzero(area)):
+                    tile_x, tile_y = int(chunk_left + left + x), int(chunk_top + top + y)
+                    mask = self.tile_types[area[y, x]].mask
+                    if mask.overlap(sprite.mask, (rect.x - tile_x * self.tile_width, rect.y - tile_y * self.tile_height)):
+                        collided.append(layer.tile_at(tile_x, tile_y))
         return collided
 
     def collide_point(self, x, y):
         collided = []
-        for layer in self.layers:
-            if not layer.has_collision:
+        tile_x, tile_y = int(x // self.tile_width), int(y // self.tile_height)
+        chunk = self.get_chunk((tile_x // self.chunk_tiles, tile_y // self.chunk_tiles))
+        if chunk is None:
+            return collided
+
+        for layer in self.collision_layers:
+            grid = chunk.grids[layer.index]
+            if grid is None:
                 continue
-            tile_number = int(y // self.info['tile_height'] * self.info['width'] + x // self.info['tile_width'])
-            if tile_number < 0 or tile_number >= len(layer.tiles):
-                break
-            tile = layer.tiles[tile_number]
-            if tile.mask.get_at((x % self.info['tile_width'], y % self.info['tile_height'])):
-                collided.append(tile)
-
+            tile_id = grid[tile_y % self.chunk_tiles, tile_x % self.chunk_tiles]
+            if tile_id != 0 and self.tile_types[tile_id].mask.get_at((int(x % self.tile_width), int(y % self.tile_height))):
+                collided.append(layer.tile_at(tile_x, tile_y))
         return collided
 
 
+class LevelChunk:
+    def __init__(self, level: Level, key: tuple[int, int]):
+        self.level = level
+        self.key = key
+        self.grids: list[np.ndarray | None] = [layer.grid(key) for layer in level.layers]
+        self.surface: pygame.Surface | None = None
+        self.overlay_tiles: list[Tile] = []
+
+        # Анимированные тайлы твёрдых слоёв сообщают свои прямоугольники, когда анимация меняет столкновения
+        self.collision_rects: list[tuple[AnimationSequence, pygame.Rect]] = []
+        for layer, grid in zip(level.layers, self.grids):
+            if grid is None:
+                continue
+            for tile_id in np.unique(grid):
+                tile_type = level.tile_type(int(tile_id))
+                if not layer.has_collision or not tile_type.animated:
+                    continue
+                for y, x in zip(*np.nonzero(grid == tile_id)):
+                    rect = self.tile(layer, int(x), int(y)).rect
+                    tile_type.sequence.collision_rects.append(rect)
+                    self.collision_rects.append((tile_type.sequence, rect))
+
+        # Твёрдые части статичных тайлов слиты в несколько прямоугольников, анимированные проверяются по текущему кадру
+        solid_cells: list[pygame.Rect] = []
+        self.animated_solids: list[tuple[AnimationSequence, int, int]] = []
+        for layer, grid in zip(level.layers, self.grids):
+            if grid is None or not layer.has_collision:
+                continue
+            for y, x in zip(*np.nonzero(grid)):
+                tile_type = level.tile_types[grid[y, x]]
+                tile_x = (key[0] * level.chunk_tiles + int(x)) * level.tile_width
+                tile_y = (key[1] * level.chunk_tiles + int(y)) * level.tile_height
+                if tile_type.animated:
+                    self.animated_solids.append((tile_type.sequence, tile_x, tile_y))
+                elif tile_type.bounding_rect.width:
+                    solid_cells.append(tile_type.bounding_rect.move(tile_x, tile_y))
+        self.solid_rects = merge_rects(solid_cells)
+
+    def tile(self, layer: 'Layer', x: int, y: int) -> 'Tile':
+        # x, y - клетка внутри чанка
+        level = self.level
+        return Tile((self.key[0] * level.chunk_tiles + x) * level.tile_width,
+                    (self.key[1] * level.chunk_tiles + y) * level.tile_height, level.tile_width, level.tile_height,
+                    level.tile_type(int(self.grids[layer.index][y, x])), layer.has_collision)
+
+    def unload(self):
+        for sequence, rect in self.collision_rects:
+            sequence.collision_rects.remove(rect)
+        self.collision_rects.clear()
+
+    def bake(self):
+        # Статичные тайлы всех слоёв рисуются в поверхность чанка один раз, анимированные - поверх неё
+        level = self.level
+        self.surface = pygame.Surface((level.chunk_width, level.chunk_height), pygame.SRCALPHA)
+        self.overlay_tiles = []
+
+        # Тайлы над анимированным должны рисоваться после него, поэтому тоже идут в overlay
+        animated_ids = [tile_type.tile_id for tile_type in level.tile_types if tile_type is not None and tile_type.animated]
+        animated_below = np.zeros((level.chunk_tiles, level.chunk_tiles), dtype=bool)
+
+        for layer, grid in zip(level.layers, self.grids):
+            if grid is None:
+                continue
+            animated_below |= np.isin(grid, animated_ids)
+            for y, x in zip(*np.nonzero((grid != 0) & animated_below)):
+                self.overlay_tiles.append(self.tile(layer, int(x), int(y)))
+
+            self.surface.blits([(level.tile_types[grid[y, x]].image, (x * level.tile_width, y * level.tile_height))
+                                for y, x in zip(*np.nonzero((grid != 0) & ~animated_below))], doreturn=False)
+
+        if display_ready():
+            self.surface = self.surface.convert_alpha()
+
+
+def mask_bounding_rect(mask: pygame.mask.Mask) -> pygame.Rect:
+    rects = mask.get_bounding_rects()
+    return rects[0].unionall(rects[1:]) if rects else pygame.Rect(0, 0, 0, 0)
+
+
+def merge_rects(rects: list[pygame.Rect]) -> list[pygame.Rect]:
+    # Соседние прямоугольники одной высоты склеиваются в строки, затем строки одной ширины - в столбцы
+    rows: list[pygame.Rect] = []
+    for rect in sorted(rects, key=lambda rect: (rect.top, rect.height, rect.left)):
+        if rows and rows[-1].top == rect.top and rows[-1].height == rect.height and rows[-1].right == rect.left:
+            rows[-1].width += rect.width
+        else:
+            rows.append(rect.copy())
+
+    merged: list[pygame.Rect] = []
+    for rect in sorted(rows, key=lambda rect: (rect.left, rect.width, rect.top)):
+        if merged and merged[-1].left == rect.left and merged[-1].width == rect.width and merged[-1].bottom == rect.top:
+            merged[-1].height += rect.height
+        else:
+            merged.append(rect)
+    return merged
+
+
+def sweep_aabb(box, dx, dy, rects: list[pygame.Rect]) -> tuple[float, tuple[int, int] | None, pygame.Rect | None]:
+    # Сдвигает box на (dx, dy) и возвращает долю пути до первого столкновения, нормаль и прямоугольник.
+    # Прямоугольники, с которыми box уже пересекается, не учитываются, чтобы из них всегда можно было выйти
+    x, y, width, height = box
+    hit_time, hit_normal, hit_rect = 1.0, None, None
+    for rect in rects:
+        if x < rect.right and x + width > rect.left and y < rect.bottom and y + height > rect.top:
+            continue
+
+        if dx > 0:
+            x_entry, x_exit = (rect.left - x - width) / dx, (rect.right - x) / dx
+        elif dx < 0:
+            x_entry, x_exit = (rect.right - x) / dx, (rect.left - x - width) / dx
+        elif x + width <= rect.left or x >= rect.right:
+            continue
+        else:
+            x_entry, x_exit = -math.inf, math.inf
+
+        if dy > 0:
+            y_entry, y_exit = (rect.top - y - height) / dy, (rect.bottom - y) / dy
+        elif dy < 0:
+            y_entry, y_exit = (rect.bottom - y) / dy, (rect.top - y - height) / dy
+        elif y + height <= rect.top or y >= rect.bottom:
+            continue
+        else:
+            y_entry, y_exit = -math.inf, math.inf
+
+        entry = max(x_entry, y_entry)
+        if entry >= min(x_exit, y_exit) or entry < 0 or entry >= hit_time:
+            continue
+        hit_time, hit_rect = entry, rect
+        if x_entry > y_entry:
+            hit_normal = (-1 if dx > 0 else 1, 0)
+        else:
+            hit_normal = (0, -1 if dy > 0 else 1)
+    return hit_time, hit_normal, hit_rect
+
+
+class LevelCache:
+    # Уровень из кэша общий для всех, кто его запросил. Загруженные и выброшенные чанки - только кэш
+    # скомпилированных данных, а часы анимаций принадлежат сессии: взяв уровень, сессия вызывает reset()
+    def __init__(self, max_size=6):
+        self.max_size = max_size
+        self.levels: OrderedDict[tuple[str, float], Level] = OrderedDict()
+        self.loading: dict[tuple[str, float], Future] = dict()
+        self.lock = threading.Lock()  # Защищает только словари, сами уровни грузятся без неё
+
+    @staticmethod
+    def get_key(name: str) -> tuple[str, float]:
+        return name, max(os.path.getmtime(filename) for filename in source_files(name))
+
+    def get(self, name: str) -> Level:
+        key = self.get_key(name)
+        with self.lock:
+            if key in self.levels:
+                self.levels.move_to_end(key)
+                return self.levels[key]
+            loading = self.loading.get(key)
+            if loading is None:
+                loading = self.loading[key] = Future()
+                loader = True
+            else:
+                loader = False
+
+        # Уровень, который уже грузится, ждём, а не грузим второй раз. Запросы других уровней не ждут
+        if not loader:
+            return loading.result()
+
+        try:
+            level = Level(name)
+        except BaseException as e:
+            with self.lock:
+                self.loading.pop(key)
+            loading.set_exception(e)
+            raise
+
+        with self.lock:
+            self.loading.pop(key)
+            for old_key in [old_key for old_key in self.levels.keys() if old_key[0] == name]:
+                self.levels.pop(old_key)
+            self.levels[key] = level
+            while len(self.levels) > self.max_size:
+                self.levels.popitem(last=False)
+        loading.set_result(level)
+        return level
+
+
+level_cache = LevelCache()
+
+
 class GameObjectRect:
     def __init__(self, x, y, width, height, name):
         self.name = name
@@ -183,48 +446,159 @@ class GameObjectPoint:
 
 
 class Layer:
-    def __init__(self, has_collision, tiles):
+    def __init__(self, has_collision, chunks: dict[tuple[int, int], memoryview], chunk_tiles: int):
         self.has_collision = has_collision
-        self.tiles: list[Tile] = tiles
+        self.chunks = chunks
+        self.chunk_tiles = chunk_tiles
+        self.level: Level | None = None
+        self.index = 0
+        self.tiles = LayerTiles(self)
+
+    def grid(self, key: tuple[int, int]) -> np.ndarray | None:
+        # id тайлов чанка в int16, grid[y, x]
+        if key not in self.chunks.keys():
+            return None
+        return np.frombuffer(self.chunks[key], dtype=np.int16).reshape(self.chunk_tiles, self.chunk_tiles)
+
+    def tile_at(self, x: int, y: int) -> 'Tile':
+        level = self.level
+        chunk = level.get_chunk((x // self.chunk_tiles, y // self.chunk_tiles))
+        grid = chunk.grids[self.index] if chunk is not None else None
+        tile_id = int(grid[y % self.chunk_tiles, x % self.chunk_tiles]) if grid is not None else 0
+        return Tile(x * level.tile_width, y * level.tile_height, level.tile_width, level.tile_height,
+                    level.tile_type(tile_id), self.has_collision)
+
+
+class LayerTiles(Sequence):
+    # Старый интерфейс списка тайлов в границах карты, объекты Tile создаются при обращении
+    def __init__(self, layer: Layer):
+        self.layer = layer
+
+    def __len__(self):
+        return self.layer.level.info['width'] * self.layer.level.info['height']
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        info = self.layer.level.info
+        return self.layer.tile_at(info['x'] + index % info['width'], info['y'] + index // info['width'])
+
+
+class AnimationSequence:
+    FRAME_TIME = 0.15
+
+    def __init__(self, first_image_id: int, animations: dict[int, int], tile_images: list[pygame.Surface]):
+        self.frames: list[int] = [first_image_id]
+        while self.frames[-1] in animations.keys() and animations[self.frames[-1]] not in self.frames:
+            self.frames.append(animations[self.frames[-1]])
+        # С какого кадра продолжать после последнего, None - анимация останавливается на последнем кадре
+        self.loop_start = None
+        if self.frames[-1] in animations.keys():
+            self.loop_start = self.frames.index(animations[self.frames[-1]])
+
+        self.masks = [pygame.mask.from_surface(tile_images[image_id]) for image_id in self.frames]
+        first_mask = self.masks[0]
+        self.changes_collision = any(mask.overlap_area(first_mask, (0, 0)) != mask.count() or
+                                     mask.count() != first_mask.count() for mask in self.masks)
+        if not self.changes_collision:
+            self.masks = [first_mask] * len(self.frames)
+        self.bounding_rects = [mask_bounding_rect(mask) for mask in self.masks]
+        self.collision_rects: list[pygame.Rect] = []
+
+        self.frame = 0
+
+    @property
+    def image_id(self) -> int:
+        return self.frames[self.frame]
+
+    @property
+    def mask(self) -> pygame.mask.Mask:
+        return self.masks[self.frame]
+
+    @property
+    def bounding_rect(self) -> pygame.Rect:
+        return self.bounding_rects[self.frame]
+
+    def frame_at(self, animation_time: float) -> int:
+        step = int(animation_time // AnimationSequence.FRAME_TIME)
+        if step < len(self.frames):
+            return step
+        if self.loop_start is None:
+            return len(self.frames) - 1
+        return self.loop_start + (step - self.loop_start) % (len(self.frames) - self.loop_start)
+
+    def update(self, animation_time: float) -> bool:
+        # Кадр считается от часов уровня, поэтому все тайлы анимации в фазе, когда бы ни загрузился их чанк
+        frame = self.frame_at(animation_time)
+        if frame == self.frame:
+            return False
+        self.frame = frame
+        return True
+
+
+class TileType:
+    # Общие данные всех клеток с одинаковым id тайла
+    def __init__(self, tile_id, image_id: int, tile_images: list[pygame.Surface],
+                 sequence: AnimationSequence | None = None):
+        self.tile_images = tile_images
+        self.sequence = sequence
+        self.animated = sequence is not None
 
+        self.tile_id = tile_id
+        self.static_image_id = image_id
+        self.static_mask = None if self.animated else pygame.mask.from_surface(tile_images[image_id])
+        self.static_bounding_rect = None if self.animated else mask_bounding_rect(self.static_mask)
 
-class Tile(pygame.sprite.Sprite):
-    tile_images: list[pygame.Surface]
-    animations: dict[int, int]
+    @property
+    def image_id(self) -> int:
+        return self.sequence.image_id if self.animated else self.static_image_id
 
-    def __init__(self, x, y, width, height, tile_id, image_id: int, has_collision):
-        super().__init__()
+    @property
+    def image(self) -> pygame.Surface:
+        return self.tile_images[self.image_id]
 
-        self.has_collision = has_collision
-        self.animated = False
+    @property
+    def mask(self) -> pygame.mask.Mask:
+        return self.sequence.mask if self.animated else self.static_mask
 
-        self.tile_id = tile_id
-        self.image_id = image_id
+    @property
+    def bounding_rect(self) -> pygame.Rect:
+        return self.sequence.bounding_rect if self.animated else self.static_bounding_rect
 
+
+class Tile:
+    # Одна клетка слоя, только вид на сетку слоя и её TileType
+    def __init__(self, x, y, width, height, tile_type: TileType, has_collision):
+        self.tile_type = tile_type
+        self.has_collision = has_collision
         self.rect = pygame.Rect((x, y), (width, height))
-        self.mask = pygame.mask.from_surface(Tile.tile_images[self.image_id])
 
-        self.timer = 0
-        self.delay = 0.15
+    @property
+    def tile_id(self) -> int:
+        return self.tile_type.tile_id
 
-    def visible(self, offset_x, offset_y, scale):
-        return not (self.rect.bottom + offset_y <= 0 or self.rect.top + offset_y >= HEIGHT // scale or
-                    self.rect.right + offset_x <= 0 or self.rect.left + offset_x >= WIDTH // scale)
+    @property
+    def image_id(self) -> int:
+        return self.tile_type.image_id
 
-    def update(self, time_delta):
-        if not self.animated:
-            return
+    @property
+    def mask(self) -> pygame.mask.Mask:
+        return self.tile_type.mask
 
-        self.timer += time_delta
-        if self.timer < self.delay:
-            return
+    @property
+    def animated(self) -> bool:
+        return self.tile_type.animated
 
-        self.image_id = Tile.animations[self.image_id]
-        self.mask = pygame.mask.from_surface(Tile.tile_images[self.image_id])  # TODO надо ли?
-        self.timer = 0
+    def visible(self, offset_x, offset_y, scale):
+        return not (self.rect.bottom + offset_y <= 0 or self.rect.top + offset_y >= HEIGHT // scale or
+                    self.rect.right + offset_x <= 0 or self.rect.left + offset_x >= WIDTH // scale)
 
     def distance(self, pos_x, pos_y):
         return ((pos_x - self.rect.x) ** 2 + (pos_y - self.rect.y) ** 2) ** 0.5
 
     def draw(self, screen: pygame.Surface, offset_x, offset_y, scale):
-        screen.blit(Tile.tile_images[self.image_id], (self.rect.x + offset_x, self.rect.y + offset_y))
+        screen.blit(self.tile_type.image, (self.rect.x + offset_x, self.rect.y + offset_y))
@@ -0,0 +1,291 @@
+'''Компилятор уровней.
+
+Каждая папка data/levels/<name> превращается в один бинарный файл <name>.compiled:
+  заголовок (MAGIC, версия формата, длина JSON), JSON с описанием уровня,
+  чанки слоёв по CHUNK_TILES x CHUNK_TILES тайлов (int16, пустые чанки не хранятся)
+  и нарезанный тайлсет в RGBA, где картинки тайлов лежат друг под другом.
+Файл пересобирается, если хэш исходников не совпадает с записанным в нём.
+
+Поддерживаются конечные и бесконечные карты Tiled, данные слоёв в csv, xml и base64
+(без сжатия, zlib, gzip, zstd). Для zstd нужен пакет zstandard.
+
+Запуск: python level_compiler.py [названия уровней]
+'''
+
+import base64
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import xml.etree.ElementTree as ET
+import zlib
+from fnmatch import fnmatch
+
+import numpy as np
+import pygame
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b'KLVL'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sHI')
+COMPILED_EXTENSION = '.compiled'
+SOURCE_EXTENSIONS = ('.tmx', '.tsx', '.png')  # Остальное в папке уровня (скомпилированный файл, .tmp) не исходники
+CHUNK_TILES = 16
+GID_MASK = 0x1FFFFFFF  # Старшие биты gid - флаги отражения тайла, они не поддерживаются
+
+
+def level_path(name: str) -> str:
+    return os.path.join("data", "levels", name)
+
+
+def compiled_path(name: str) -> str:
+    return os.path.join(level_path(name), name + COMPILED_EXTENSION)
+
+
+def source_files(name: str) -> list[str]:
+    path = level_path(name)
+    return sorted(os.path.join(path, filename) for filename in os.listdir(path)
+                  if filename.lower().endswith(SOURCE_EXTENSIONS))
+
+
+def source_hash(name: str) -> str:
+    sha = hashlib.sha1()
+    for filename in source_files(name):
+        sha.update(os.path.basename(filename).encode())
+        with open(filename, 'rb') as file:
+            sha.update(file.read())
+    return sha.hexdigest()
+
+
+def decode_data(data: ET.Element, encoding: str | None, compression: str | None) -> np.ndarray:
+    # У бесконечной карты data - это чанк, кодировка указана у родительского элемента
+    if encoding is None:
+        return np.array([int(tile.get('gid', 0)) for tile in data.findall('tile')], dtype=np.uint32)
+    if encoding == 'csv':
+        return np.array([int(gid) for gid in data.text.split(',')], dtype=np.uint32)
+    if encoding != 'base64':
+        raise Exception(f'Unknown layer encoding {encoding}')
+
+    raw = base64.b64decode(data.text.strip())
+    if compression == 'zlib':
+        raw = zlib.decompress(raw)
+    elif compression == 'gzip':
+        raw = gzip.decompress(raw)
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise Exception('zstandard package is required for zstd-compressed levels')
+        raw = zstandard.ZstdDecompressor().decompressobj().decompress(raw)
+    elif compression is not None:
+        raise Exception(f'Unknown layer compression {compression}')
+    return np.frombuffer(raw, dtype='<u4')
+
+
+def layer_regions(layer: ET.Element, infinite: bool) -> list[tuple[int, int, np.ndarray]]:
+    # Прямоугольные куски слоя: (x, y, массив gid), у конечной карты кусок один
+    data = layer.find('data')
+    encoding, compression = data.get('encoding'), data.get('compression')
+    if not infinite:
+        width, height = int(layer.get('width')), int(layer.get('height'))
+        return [(0, 0, decode_data(data, encoding, compression).reshape(height, width))]
+
+    regions = []
+    for chunk in data.findall('chunk'):
+        width, height = int(chunk.get('width')), int(chunk.get('height'))
+        regions.append((int(chunk.get('x')), int(chunk.get('y')), decode_data(chunk, encoding, compression).reshape(height, width)))
+    return regions
+
+
+def split_into_chunks(regions: list[tuple[int, int, np.ndarray]], first_gid: int) -> dict[tuple[int, int], np.ndarray]:
+    chunks: dict[tuple[int, int], np.ndarray] = dict()
+    for region_x, region_y, gids in regions:
+        gids = gids & GID_MASK
+        tile_ids = np.where(gids == 0, 0, gids.astype(np.int64) - first_gid + 1).astype(np.int16)
+        height, width = tile_ids.shape
+        for chunk_y in range(region_y // CHUNK_TILES, (region_y + height - 1) // CHUNK_TILES + 1):
+            for chunk_x in range(region_x // CHUNK_TILES, (region_x + width - 1) // CHUNK_TILES + 1):
+                left, top = max(region_x, chunk_x * CHUNK_TILES), max(region_y, chunk_y * CHUNK_TILES)
+                right = min(region_x + width, (chunk_x + 1) * CHUNK_TILES)
+                bottom = min(region_y + height, (chunk_y + 1) * CHUNK_TILES)
+                chunk = chunks.setdefault((chunk_x, chunk_y), np.zeros((CHUNK_TILES, CHUNK_TILES), dtype=np.int16))
+                chunk[top - chunk_y * CHUNK_TILES:bottom - chunk_y * CHUNK_TILES,
+                      left - chunk_x * CHUNK_TILES:right - chunk_x * CHUNK_TILES] = \
+                    tile_ids[top - region_y:bottom - region_y, left - region_x:right - region_x]
+    return {key: chunk for key, chunk in chunks.items() if chunk.any()}
+
+
+def parse_level(name: str) -> tuple[dict, list[dict[tuple[int, int], np.ndarray]], bytes]:
+    path = level_path(name)
+
+    map_xml = None
+    for filename in os.listdir(path):
+        if fnmatch(filename, '*.tmx'):
+            map_xml = ET.parse(os.path.join(path, filename))
+
+    if map_xml is None:
+        raise Exception(f'Level {name} has no .tmx file')
+
+    map_xml_root = map_xml.getroot()
+    infinite = map_xml_root.get('infinite') == '1'
+
+    tileset_element = map_xml_root.find('tileset')
+    first_gid = int(tileset_element.get('firstgid', 1))
+    tileset_source = os.path.join(path, tileset_element.get('source'))
+    tileset_xml_root = ET.parse(tileset_source).getroot()
+
+    tilewidth = int(tileset_xml_root.get('tilewidth'))
+    tileheight = int(tileset_xml_root.get('tileheight'))
+    image = pygame.image.load(os.path.join(path, tileset_xml_root.find('image').get('source')))
+
+    animations: dict[int, int] = dict()  # Какая картинка следует за текущей
+    for tile in tileset_xml_root.findall('tile'):
+        animations[int(tile.get('id'))] = int(tile.find('properties').find('property').get('value'))
+
+    # Тайлы кладутся друг под другом, чтобы картинка каждого занимала непрерывный кусок памяти
+    columns = image.get_width() // tilewidth
+    tile_count = columns * (image.get_height() // tileheight)
+    strip = pygame.Surface((tilewidth, tileheight * tile_count), pygame.SRCALPHA)
+    for i in range(tile_count):
+        area = ((i % columns) * tilewidth, (i // columns) * tileheight, tilewidth, tileheight)
+        strip.blit(image, (0, i * tileheight), area)
+
+    layers_info, layers_chunks = [], []
+    for layer in map_xml_root.findall('layer'):
+        properties = layer.find('properties')
+        has_collision = properties is not None and properties.find('property').get('value') == 'true'
+        layers_info.append({'name': layer.get('name'), 'has_collision': has_collision})
+        layers_chunks.append(split_into_chunks(layer_regions(layer, infinite), first_gid))
+
+    # Границы карты в тайлах, у бесконечной карты координаты могут быть отрицательными
+    keys = [key for chunks in layers_chunks for key in chunks.keys()] or [(0, 0)]
+    if infinite:
+        map_x = min(key[0] for key in keys) * CHUNK_TILES
+        map_y = min(key[1] for key in keys) * CHUNK_TILES
+        map_width = (max(key[0] for key in keys) + 1) * CHUNK_TILES - map_x
+        map_height = (max(key[1] for key in keys) + 1) * CHUNK_TILES - map_y
+    else:
+        map_x, map_y = 0, 0
+        map_width, map_height = int(map_xml_root.get('width')), int(map_xml_root.get('height'))
+
+    objects = {'rectangles': [], 'points': []}
+    for objectgroup in map_xml_root.findall('objectgroup'):
+        for game_object in objectgroup.findall('object'):
+            object_name = game_object.get('name')
+            x, y = int(float(game_object.get('x'))), int(float(game_object.get('y')))
+            if game_object.find('point') is not None:
+                objects['points'].append([x, y, object_name])
+            elif game_object.find('ellipse') is not None:
+                pass
+            elif game_object.find('polygon') is not None:
+                pass
+            else:
+                width, height = int(float(game_object.get('width'))), int(float(game_object.get('height')))
+                objects['rectangles'].append([x, y, width, height, object_name])
+
+    description = {
+        'info': {'name': name,
+                 'scale': int(map_xml_root.find('properties').find('property').get('value')),
+                 'x': map_x,
+                 'y': map_y,
+                 'width': map_width,
+                 'height': map_height,
+                 'tile_width': tilewidth,
+                 'tile_height': tileheight},
+        'layers': layers_info,
+        'objects': objects,
+        'animations': animations,
+        'chunk_tiles': CHUNK_TILES,
+        'tileset': {'tile_count': tile_count},
+    }
+    return description, layers_chunks, pygame.image.tobytes(strip, 'RGBA')
+
+
+def compile_level(name: str) -> bytes:
+    description, layers_chunks, tileset_data = parse_level(name)
+    description['source_hash'] = source_hash(name)
+    description['byteorder'] = sys.byteorder
+
+    blobs = []
+    offset = 0
+    for layer_info, chunks in zip(description['layers'], layers_chunks):
+        layer_info['chunks'] = []
+        for (chunk_x, chunk_y), chunk in chunks.items():
+            layer_info['chunks'].append([chunk_x, chunk_y, offset, chunk.nbytes])
+            blobs.append(chunk.tobytes())
+            offset += chunk.nbytes + (-chunk.nbytes) % 8
+    description['tileset']['offset'], description['tileset']['length'] = offset, len(tileset_data)
+    blobs.append(tileset_data)
+
+    header_json = json.dumps(description).encode()
+    header_json += b' ' * ((-(HEADER.size + len(header_json))) % 8)
+    result = bytearray(HEADER.pack(MAGIC, FORMAT_VERSION, len(header_json)) + header_json)
+    for blob in blobs:
+        result += blob + b'\0' * ((-len(blob)) % 8)
+    return bytes(result)
+
+
+def read_header(buffer) -> tuple[dict, int] | None:
+    if len(buffer) < HEADER.size:
+        return None
+    magic, version, header_length = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        return None
+    description = json.loads(bytes(buffer[HEADER.size:HEADER.size + header_length]))
+    if description['byteorder'] != sys.byteorder:
+        return None
+    return description, HEADER.size + header_length
+
+
+def open_compiled(name: str):
+    try:
+        with open(compiled_path(name), 'rb') as file:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+    except (OSError, ValueError):
+        return None
+
+
+def load_compiled(name: str) -> tuple[dict, list[dict[tuple[int, int], memoryview]], memoryview]:
+    buffer = open_compiled(name)
+    header = read_header(buffer) if buffer is not None else None
+    if header is None or header[0]['source_hash'] != source_hash(name):
+        buffer = compile_level(name)
+        # Клиент и сервер могут компилировать один уровень одновременно, поэтому у каждого свой временный файл
+        temporary_path = f'{compiled_path(name)}.{os.getpid()}.tmp'
+        try:
+            with open(temporary_path, 'wb') as file:
+                file.write(buffer)
+            os.replace(temporary_path, compiled_path(name))
+            buffer = open_compiled(name) or buffer
+        except OSError as e:
+            print(e, '<- failed to save compiled level')
+        buffer = bytearray(buffer) if isinstance(buffer, bytes) else buffer
+        header = read_header(buffer)
+
+    description, data_offset = header
+    view = memoryview(buffer)
+    layers_chunks = []
+    for layer_info in description['layers']:
+        chunks = dict()
+        for chunk_x, chunk_y, offset, length in layer_info.pop('chunks'):
+            start = data_offset + offset
+            chunks[(chunk_x, chunk_y)] = view[start:start + length].cast('h')
+        layers_chunks.append(chunks)
+    start = data_offset + description['tileset']['offset']
+    tileset_data = view[start:start + description['tileset']['length']]
+    return description, layers_chunks, tileset_data
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or [name for name in os.listdir(os.path.join("data", "levels"))
+                             if os.path.isdir(level_path(name))]
+    for level_name in names:
+        compiled = compile_level(level_name)
+        with open(compiled_path(level_name), 'wb') as compiled_file:
+            compiled_file.write(compiled)
+        print(f'{level_name}: {len(compiled)} bytes')
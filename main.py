@@ -1,21 +1,32 @@
 from __future__ import annotations
+from concurrent.futures import Future, ThreadPoolExecutor
+from time import time
+
 import config
+from startup_profiler import profiler
+
+if config.PROFILE_STARTUP:
+    profiler.install()
+
 import pygame
 
-pygame.init()
-pygame.mixer.init()
+with profiler.section('pygame.init'):
+    pygame.init()
+    pygame.mixer.init()
 
-from config import WIDTH, HEIGHT, MAX_FPS, FULLSCREEN, WEBCAM
-from gui_elements import PlayerStat
+from assets import Atlas
+from config import WIDTH, HEIGHT, MAX_FPS, FULLSCREEN, WEBCAM, RECORD_TRAFFIC, PLAYER_INFO_RATE
+from frame_profiler import frame_profiler
+from gui_elements import FrameTimeOverlay, PlayerStat
 from event_codes import *
-from level import Level, Tile
+from level import Level, sweep_aabb
 from network import Network
-from player import Player
+from player import Player, load_character_sprites
 from screens import Menu, ConnectToServerMenu, LoadingScreen, MessageScreen, StartServerMenu, SettingsMenu, EndScreen, PauseMenu
 from script_manager import ScriptManager
-from server import ServerManager
-from sound import SoundCore
-from weapon import Weapon, Bullet
+from server_manager import ServerManager
+from sound import SoundCore, load_weapon_sound
+from weapon import Weapon, Bullet, Tracer
 
 
 class Camera:
@@ -62,44 +73,91 @@ class Camera:
 
 
 class Game:
-    def __init__(self, clock: pygame.time.Clock, game_manager: GameManager, level_name="", player_position=(0, 0)):
+    SIMULATION_RATE = 120  # Шагов симуляции в секунду, не зависит от частоты кадров
+    MAX_FRAME_TIME = 0.25  # Более долгий кадр (загрузка, перетаскивание окна) не догоняется
+
+    def __init__(self, clock: pygame.time.Clock, game_manager: GameManager, level_name="", player_position=(0, 0),
+                 level: Level = None):
         self.clock = clock
         self.game_manager = game_manager
         self.offset_x, self.offset_y = 0, 0
 
-        self.level = Level(level_name)
+        self.level = level if level is not None else Level(level_name)
         self.player = Player((0, 0), 1, "Knight")
         self.player.set_right(player_position[0] + self.player.width // 2)
         self.player.set_top(player_position[1])
         self.players: dict[int, Player] = {}
         self.bullets: dict[int, Bullet] = {}
+        self.tracers: list[Tracer] = []
         self.weapons: dict[int, Weapon] = {}
+        self.awake_weapons: set[int] = set()
+        self.player_contacts: set[str] = set()
+        self.render_targets: tuple[pygame.Surface, pygame.Surface] | None = None
+        self.render_targets_key = None
         self.player_bar = PlayerStat(self.player.weapon.ammo, self.player.weapon.name, 100)
 
         self.camera = Camera(self.player)
 
+        self.accumulator = 0
+        self.interpolation = 1
+        self.previous_positions: dict[object, tuple[float, float]] = {}
+
     def update(self):
-        fps = self.clock.get_fps()
-        time_delta = 1 / max(1, fps)
-        for bullet_id, bullet in self.bullets.items():
+        # Симуляция идёт фиксированными шагами, остаток времени переходит на следующий кадр,
+        # а кадр рисуется между двумя последними шагами
+        self.input_handle()
+        time_step = 1 / Game.SIMULATION_RATE
+        self.accumulator += min(self.clock.get_time() / 1000, Game.MAX_FRAME_TIME)
+        while self.accumulator >= time_step:
+            self.remember_positions()
+            self.step(time_step)
+            self.accumulator -= time_step
+        self.interpolation = self.accumulator / time_step
+
+    def remember_positions(self):
+        entities = [self.camera, self.player] + list(self.players.values()) + list(self.bullets.values())
+        entities += [weapon for weapon in self.weapons.values() if not weapon.attached]
+        self.previous_positions = {entity: (entity.x, entity.y) for entity in entities}
+
+    def interpolate(self, entity) -> tuple[float, float]:
+        # Сдвиг назад от последнего шага к точке между двумя шагами
+        if entity not in self.previous_positions:
+            return 0, 0
+        previous_x, previous_y = self.previous_positions[entity]
+        back = 1 - self.interpolation
+        return (previous_x - entity.x) * back, (previous_y - entity.y) * back
+
+    def draw_offset(self, entity) -> tuple[float, float]:
+        dx, dy = self.interpolate(entity)
+        return self.offset_x + dx, self.offset_y + dy
+
+    def step(self, time_delta):
+        for bullet_id in list(self.bullets.keys()):
+            bullet = self.bullets[bullet_id]
             bullet.update(time_delta)
+            if bullet.is_dead(self.level):
+                self.bullets.pop(bullet_id)
+        for tracer in self.tracers:
+            tracer.update(time_delta)
+        self.tracers = [tracer for tracer in self.tracers if not tracer.is_dead()]
 
         if not self.game_manager.packet_received:
             for player_id, player in self.players.items():
                 if player_id == self.game_manager.network.id:
                     continue
-                player.loop(time_delta)
-                self.collision_y(player)
-
-        self.player.loop(time_delta)
-        self.input_handle(time_delta)
+                dx, dy = player.loop(time_delta)
+                with frame_profiler.section('collision'):
+                    self.move_player(player, dx, dy)
+
+        dx, dy = self.player.loop(time_delta)
+        with frame_profiler.section('collision'):
+            self.player_contacts = self.move_player(self.player, dx, dy)
+        self.movement_input()
         self.camera.update(time_delta)
         self.level.update(time_delta)
         self.player_bar.update({'weapon_name': self.player.weapon.name, 'value': self.player.hp, 'left_ammo': self.player.weapon.ammo, 'max_ammo': self.player.weapon.maximum_ammo()})
 
-        for weapon_id, weapon in self.weapons.items():
-            weapon.update(time_delta, self.level)
-            weapon.update_sprite(time_delta)
+        self.update_weapons(time_delta)
 
         for player_id, player in self.players.items():
             if player_id == self.game_manager.network.id:
@@ -107,51 +165,94 @@ class Game:
             if player.weapon.name == 'WeaponNone':
                 player.weapon.update_sprite(time_delta)
 
-    def draw(self, screen):
-        image = pygame.Surface((WIDTH // self.level.scale, HEIGHT // self.level.scale))
+    def wake_weapon(self, weapon_id):
+        self.weapons[weapon_id].wake()
+        self.awake_weapons.add(weapon_id)
 
-        self.update()
-        self.offset_x = -self.camera.x + WIDTH // self.level.scale // 2
-        self.offset_y = -self.camera.y + HEIGHT // self.level.scale // 2
+    def update_weapons(self, time_delta):
+        for weapon_id in list(self.awake_weapons):
+            weapon = self.weapons[weapon_id]
+            weapon.update(time_delta, self.level)
+            if not weapon.attached and weapon.sleeping:
+                self.awake_weapons.remove(weapon_id)
 
-        self.level.draw(image, self.offset_x, self.offset_y, *self.player.get_position())
-        for player_id, player in self.players.items():
-            player.draw(image, self.offset_x, self.offset_y)
-        self.player.draw(image, self.offset_x, self.offset_y)
+        if self.level.changed_rects:
+            for weapon_id, weapon in self.weapons.items():
+                if weapon.sleeping and weapon.wake_near(self.level.changed_rects):
+                    self.awake_weapons.add(weapon_id)
 
         for weapon_id, weapon in self.weapons.items():
-            if not weapon.attached:
-                weapon.draw(image, self.offset_x, self.offset_y)
+            weapon.update_sprite(time_delta)
 
-        for bullet_id, bullet in self.bullets.items():
-            bullet.draw(image, self.offset_x, self.offset_y)
+    def get_render_targets(self, screen: pygame.Surface) -> tuple[pygame.Surface, pygame.Surface]:
+        # Поверхности пересоздаются только при смене масштаба или экрана
+        key = (self.level.scale, id(screen), screen.get_size())
+        if self.render_targets_key != key:
+            image = pygame.Surface((WIDTH // self.level.scale, HEIGHT // self.level.scale))
+            scaled_size = (int(image.get_width() * self.level.scale), int(image.get_height() * self.level.scale))
+            # Увеличенный кадр пишется прямо в экран, если помещается в него
+            if scaled_size[0] <= screen.get_width() and scaled_size[1] <= screen.get_height():
+                scaled_image = screen.subsurface((0, 0), scaled_size)
+            else:
+                scaled_image = pygame.Surface(scaled_size)
+            self.render_targets = (image, scaled_image)
+            self.render_targets_key = key
+        return self.render_targets
 
-        image = pygame.transform.scale_by(image, self.level.scale)
-        screen.blit(image, (0, 0))
-        if self.level.info['name'] != 'lobby' and 'lastmap' not in self.level.info['name']:
-            self.player_bar.draw(screen, self.player.color)
+    def draw(self, screen):
+        image, scaled_image = self.get_render_targets(screen)
+        image.fill((0, 0, 0))
+
+        with frame_profiler.section('physics'):
+            self.update()
+        camera_dx, camera_dy = self.interpolate(self.camera)
+        self.offset_x = -(self.camera.x + camera_dx) + WIDTH // self.level.scale // 2
+        self.offset_y = -(self.camera.y + camera_dy) + HEIGHT // self.level.scale // 2
+
+        with frame_profiler.section('level'):
+            self.level.draw(image, self.offset_x, self.offset_y, *self.player.get_position())
+
+        with frame_profiler.section('entities'):
+            for player_id, player in self.players.items():
+                player.draw(image, *self.draw_offset(player))
+            self.player.draw(image, *self.draw_offset(self.player))
+
+            for weapon_id, weapon in self.weapons.items():
+                if not weapon.attached:
+                    weapon.draw(image, *self.draw_offset(weapon))
+
+            for bullet_id, bullet in self.bullets.items():
+                bullet.draw(image, *self.draw_offset(bullet))
+            for tracer in self.tracers:
+                tracer.draw(image, self.offset_x, self.offset_y)
+
+        with frame_profiler.section('scale'):
+            pygame.transform.scale(image, scaled_image.get_size(), scaled_image)
+            if scaled_image.get_parent() is not screen:
+                screen.blit(scaled_image, (0, 0))
 
-    def input_handle(self, time_delta):
+        with frame_profiler.section('hud'):
+            if self.level.info['name'] != 'lobby' and 'lastmap' not in self.level.info['name']:
+                self.player_bar.draw(screen, self.player.color)
+
+    def movement_input(self):
+        # Движение - часть симуляции, оно читается на каждом шаге
         keys = pygame.key.get_pressed()
-        collide_vertical = self.collision_y(self.player)
-        collide_left: list[Tile] = self.collision_x(self.player, min(-1, -int(self.player.v * time_delta)) - 1)
-        collide_right: list[Tile] = self.collision_x(self.player, max(1, int(self.player.v * time_delta)) + 1)
 
         self.player.vx = 0
-        if keys[pygame.K_a] and not collide_left:
+        if keys[pygame.K_a] and 'left' not in self.player_contacts:
             self.player.move_left()
-        elif keys[pygame.K_a] and collide_left:
-            left = min(self.player.get_left(), max([tile.rect.right for tile in collide_left]))
-            self.player.set_left(left)
 
-        if keys[pygame.K_d] and not collide_right:
+        if keys[pygame.K_d] and 'right' not in self.player_contacts:
             self.player.move_right()
-        elif keys[pygame.K_d] and collide_right:
-            right = max(self.player.get_right(), min([tile.rect.left for tile in collide_right]))
-            self.player.set_right(right)
 
-        if keys[pygame.K_SPACE] and not collide_vertical:
+        if keys[pygame.K_SPACE] and 'floor' in self.player_contacts:
             self.player.jump()
+
+    def input_handle(self):
+        # Масштаб, радиус и стрельба обрабатываются раз за кадр, а не на каждом шаге симуляции
+        keys = pygame.key.get_pressed()
+
         if keys[pygame.K_UP]:
             self.level.scale += 0.05
             self.level.scale = min(self.level.scale, 8)
@@ -168,35 +269,114 @@ class Game:
         if keys[pygame.K_RETURN]:
             self.game_manager.shoot_bullet()
 
-    def collision_x(self, player, dx):
-        player.move(dx, 0)
-        collided = self.level.collide_sprite(player)
-        player.move(-dx, 0)
-        return collided
-
-    def collision_y(self, player):
-        collided = self.level.collide_sprite(player)
-        if not collided:
-            return collided
-
-        lowest_point = collided[0].rect.bottom
-        highest_point = collided[0].rect.top
-        for tile in collided:
-            lowest_point = max(lowest_point, tile.rect.bottom)
-            highest_point = min(highest_point, tile.rect.top)
-        if player.vy > 0:
-            player.set_bottom(highest_point)
+    def move_player(self, player: Player, dx, dy) -> set[str]:
+        # Движение до первого столкновения, затем скольжение вдоль стены или пола
+        x, y, width, height = player.get_hitbox()
+        rects = self.level.solid_rects_around((x, y, width, height), dx, dy)
+        contacts = set()
+
+        # Из тайлов, в которых игрок уже оказался (точка появления, анимация), выталкиваем по вертикали
+        inside = [rect for rect in rects if x < rect.right and x + width > rect.left and
+                  y < rect.bottom and y + height > rect.top]
+        if inside and dy > 0:
+            y, dy = min(rect.top for rect in inside) - height, 0
+            contacts.add('floor')
+        elif inside and dy < 0:
+            y, dy = max(rect.bottom for rect in inside), 0
+            contacts.add('ceil')
+
+        for _ in range(3):
+            hit_time, normal, rect = sweep_aabb((x, y, width, height), dx, dy, rects)
+            x, y = x + dx * hit_time, y + dy * hit_time
+            if normal is None:
+                break
+            if normal[0] != 0:
+                x = rect.right if normal[0] > 0 else rect.left - width
+                contacts.add('left' if normal[0] > 0 else 'right')
+                dx, dy = 0, dy * (1 - hit_time)
+            else:
+                y = rect.bottom if normal[1] > 0 else rect.top - height
+                contacts.add('ceil' if normal[1] > 0 else 'floor')
+                dx, dy = dx * (1 - hit_time), 0
+
+        old_x, old_y, _, _ = player.get_hitbox()
+        player.move(x - old_x, y - old_y)
+        if 'floor' in contacts:
             player.touch_down()
-        elif player.vy < 0:
-            player.set_top(lowest_point)
+        elif 'ceil' in contacts:
             player.touch_ceil()
 
-        return collided
+        # Касания без движения, чтобы нельзя было идти в стену и можно было прыгать стоя на месте
+        for contact, probe_dx, probe_dy in (('floor', 0, 1), ('left', -1, 0), ('right', 1, 0)):
+            if contact not in contacts and sweep_aabb((x, y, width, height), probe_dx, probe_dy, rects)[0] == 0:
+                contacts.add(contact)
+        return contacts
 
     def apply(self, data):
         pass
 
 
+class LevelPreloader:
+    # Следующий уровень и перекрашенные спрайты игроков готовятся в фоновом потоке,
+    # пока сервер выдерживает паузу перед сменой уровня
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    def __init__(self):
+        self.level_name: str | None = None
+        self.future: Future | None = None
+        self.sprites: list[Atlas] = []  # Оттенки хранятся слабо, поэтому держим их до смены уровня
+
+    def start(self, level_name: str, colors: list):
+        self.level_name = level_name
+        self.future = LevelPreloader.executor.submit(LevelPreloader.prepare, level_name, colors)
+
+    @staticmethod
+    def prepare(level_name: str, colors: list) -> tuple[Level, list[Atlas]]:
+        level = Level(level_name)
+        base_sprites, _ = load_character_sprites("Knight", 1)
+        return level, [base_sprites.tinted(color) for color in colors]
+
+    def take(self, level_name: str) -> Level | None:
+        # Если уровень ещё грузится, ждём его здесь, это не дольше загрузки с нуля
+        if self.future is None or self.level_name != level_name:
+            return None
+        future, self.future = self.future, None
+        try:
+            level, self.sprites = future.result()
+        except Exception as e:
+            print(e)
+            return None
+        return level
+
+
+class PlayerInfoSender:
+    # Состояние игрока уходит на сервер не чаще PLAYER_INFO_RATE раз в секунду и только если изменилось,
+    # иначе раз в KEEP_ALIVE_INTERVAL. Всё, что игрок сделал между отправками, уходит одной датаграммой
+    # с последним состоянием, так что нагрузка на сервер не зависит от fps клиента
+    KEEP_ALIVE_INTERVAL = 1
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.last_sent_time = 0
+        self.last_sent_state = None
+
+    @staticmethod
+    def state(data: list, frame: int) -> tuple:
+        # Счётчик анимации растёт каждый кадр, поэтому сравнивается номер кадра анимации:
+        # другие клиенты показывают его по снимкам, и без отправки анимация стоящего игрока замирает
+        return tuple(data[:4]) + tuple(data[5:]) + (frame,)
+
+    def due(self, data: list, frame: int, now: float) -> bool:
+        since_last = now - self.last_sent_time
+        if since_last < self.interval:
+            return False
+        return since_last >= PlayerInfoSender.KEEP_ALIVE_INTERVAL or self.state(data, frame) != self.last_sent_state
+
+    def sent(self, data: list, frame: int, now: float):
+        self.last_sent_time = now
+        self.last_sent_state = self.state(data, frame)
+
+
 class GameManager:
     from network import DataPacket
 
@@ -208,6 +388,8 @@ class GameManager:
         self.network: Network = None
         self.game: Game = None
         self.game_started = False
+        self.level_preloader = LevelPreloader()
+        self.player_info_sender = PlayerInfoSender(PLAYER_INFO_RATE)
 
         self.webcam_ready = False
 
@@ -217,6 +399,8 @@ class GameManager:
 
     def connect(self, server, port):
         self.network = Network(server, port, self.callback)
+        if RECORD_TRAFFIC:
+            self.network.start_recording(RECORD_TRAFFIC)
         self.network.authorize()
         self.disconnected = False
 
@@ -235,7 +419,10 @@ class GameManager:
         game_id = data_packet.headers['game_id']
 
         if data_packet.data_type == self.DataPacket.PING:
-            self.send(self.DataPacket(self.DataPacket.PING))
+            response_data = {'fps': round(clock.get_fps(), 1),
+                             'udp_received': self.network.udp_packets_received,
+                             'coalesced': self.network.packets_coalesced}
+            self.send(self.DataPacket(self.DataPacket.PING, response_data))
 
         if data_packet.data_type == self.DataPacket.WEBCAM_RESPONSE:
             data = data_packet['data']
@@ -256,10 +443,17 @@ class GameManager:
             event.dict['statistics'] = data_packet['statistics']
             pygame.event.post(event)
 
-        if data_packet.data_type == self.DataPacket.GAME_INFO:
+        if data_packet.data_type == self.DataPacket.NEXT_LEVEL:
+            colors = []
+            if self.game is not None:
+                colors = [self.game.player.color] + [player.color for player in self.game.players.values()]
+            self.level_preloader.start(data_packet['level_name'], colors)
+
+        if data_packet.data_type == self.DataPacket.LEVEL_BOOTSTRAP:
+            if data_packet['version'] != self.DataPacket.BOOTSTRAP_VERSION:
+                raise Exception('Server version is not supported')
             GameManager.game_id = game_id
-            self.game = Game(clock, self, data_packet['level_name'], data_packet['position'])
-            self.game.player.set_color(data_packet['color'])
+            self.game = self.build_game(data_packet.data)
             self.send_initial_info()
             self.game_started = True
 
@@ -279,42 +473,40 @@ class GameManager:
                 if str(player_id) not in data_packet.data.keys():
                     self.game.players.pop(player_id)
 
-        if data_packet.data_type == self.DataPacket.NEW_SHOT_FROM_SERVER:
-            client_id, bullet_id, bullet_data = data_packet.data
+        if data_packet.data_type == self.DataPacket.NEW_VOLLEY_FROM_SERVER:
+            client_id, first_bullet_id, (position, direction, weapon_name, seed) = data_packet.data
 
-            bullet_id = int(bullet_id)
-            self.game.bullets[bullet_id] = Bullet.from_data(bullet_data)
-            if client_id == self.network.id:
-                self.game.player.weapon.shoot()
-            else:
-                self.game.players[client_id].weapon.shoot()
+            # Дробинки залпа получают идущие подряд id начиная с first_bullet_id
+            for i, bullet in enumerate(Weapon.volley(weapon_name, position, direction, seed)):
+                self.game.bullets[first_bullet_id + i] = bullet
+            self.play_shot(client_id)
+
+        if data_packet.data_type == self.DataPacket.HITSCAN_FROM_SERVER:
+            client_id, (position, direction, weapon_name, seed), rays = data_packet.data
+            for end_x, end_y, _ in rays:
+                self.game.tracers.append(Tracer(position, (end_x, end_y)))
+            self.play_shot(client_id)
 
         if data_packet.data_type == self.DataPacket.RELOAD_WEAPON:
             weapon_id = data_packet['weapon_id']
             self.game.weapons[weapon_id].reload()
 
-        if data_packet.data_type == self.DataPacket.DELETE_BULLET_FROM_SERVER:
-            bullet_id = data_packet.data
-            bullet_id = int(bullet_id)
-            if bullet_id in self.game.bullets.keys():
-                self.game.bullets.pop(bullet_id)
+        if data_packet.data_type == self.DataPacket.DELETE_BULLETS_FROM_SERVER:
+            for bullet_id in data_packet.data:
+                self.game.bullets.pop(bullet_id, None)
 
         if data_packet.data_type == self.DataPacket.HEALTH_POINTS:
             self.game.player.hp = data_packet.data
 
-        if data_packet.data_type == self.DataPacket.NEW_WEAPON_FROM_SERVER:
-            weapon_id = data_packet['weapon_id']
-            weapon_name, weapon_x, weapon_y, weapon_ammo = data_packet['weapon_data']
-            self.game.weapons[weapon_id] = Weapon(name=weapon_name, ammo=weapon_ammo, pos=(weapon_x, weapon_y))
-
         if data_packet.data_type == self.DataPacket.CLIENT_PICKED_WEAPON:
             client_id = data_packet['owner_id']
             weapon_id = data_packet['weapon_id']
 
             if client_id == self.network.id:
                 self.game.player.attach_weapon(self.game.weapons[weapon_id])
-            else:
+            elif client_id in self.game.players:
                 self.game.players[client_id].attach_weapon(self.game.weapons[weapon_id])
+            self.game.wake_weapon(weapon_id)
 
         if data_packet.data_type == self.DataPacket.CLIENT_DROPPED_WEAPON:
             client_id = data_packet['owner_id']
@@ -325,11 +517,41 @@ class GameManager:
 
             if client_id == self.network.id:
                 self.game.player.attach_weapon(Weapon('WeaponNone', owner=self.game.player))
-            else:
+            elif client_id in self.game.players:
                 self.game.players[client_id].attach_weapon(Weapon('WeaponNone', owner=self.game.players[client_id]))
             self.game.weapons[weapon_id].x, self.game.weapons[weapon_id].y = weapon_position
             self.game.weapons[weapon_id].direction = weapon_direction
             self.game.weapons[weapon_id].ammo = weapon_ammo
+            self.game.wake_weapon(weapon_id)
+
+    def build_game(self, data) -> Game:
+        # Новая игра собирается целиком и подменяет старую одним присваиванием
+        level = self.level_preloader.take(data['level_name'])
+        for weapon_name in Weapon.all_weapons_info.keys():
+            load_weapon_sound(weapon_name)  # Оружие может появиться посреди матча
+        game = Game(clock, self, data['level_name'], data['position'], level)
+        game.player.set_color(data['color'])
+
+        for player_id, player_data in data['players'].items():
+            player_id = int(player_id)
+            if player_id == self.network.id:
+                continue
+            game.players[player_id] = Player((0, 0), 1, "Knight", player_data[9])
+            game.players[player_id].apply(player_data)
+
+        for weapon_id, weapon_info in data['weapons'].items():
+            weapon_name, weapon_x, weapon_y, weapon_ammo = weapon_info['weapon_data']
+            weapon = Weapon(name=weapon_name, ammo=weapon_ammo, pos=(weapon_x, weapon_y))
+            game.weapons[int(weapon_id)] = weapon
+            game.awake_weapons.add(int(weapon_id))
+
+            owner_id = weapon_info['owner_id']
+            if owner_id == self.network.id:
+                game.player.attach_weapon(weapon)
+            elif owner_id in game.players.keys():
+                game.players[owner_id].attach_weapon(weapon)
+
+        return game
 
     def handle_game_objects_collision(self):
         for object in self.game.level.objects['rectangles']:
@@ -346,20 +568,27 @@ class GameManager:
                     response = self.DataPacket(self.DataPacket.REMOVE_PLAYER_FLAG, response_data)
                     self.send(response)
 
+    def play_shot(self, client_id):
+        if client_id == self.network.id:
+            self.game.player.weapon.shoot()
+        elif client_id in self.game.players:
+            # Снимок с новым игроком мог прийти позже события (или быть выброшен как устаревший)
+            self.game.players[client_id].weapon.shoot()
+
     def shoot_bullet(self):
         if self.game.player.hp <= 0:
             return
         if self.game.player.weapon.name == "WeaponNone":
             return
-        bullets = self.game.player.weapon.shoot()
-        if bullets is None:
+        weapon = self.game.player.weapon
+        seed = weapon.shoot()
+        if seed is None:
             return
 
-        for bullet in bullets:
-            bullet.x = self.game.player.get_center_position()[0]
-            bullet_data = {'data': bullet.encode()}
-            response = self.DataPacket(self.DataPacket.NEW_SHOT_FROM_CLIENT, bullet_data)
-            self.send(response)
+        position = (self.game.player.get_center_position()[0], weapon.get_barrel_position()[1])
+        volley_data = {'data': [position, weapon.direction, weapon.name, seed]}
+        response = self.DataPacket(self.DataPacket.NEW_VOLLEY_FROM_CLIENT, volley_data)
+        self.send(response)
 
     def reload_weapon(self):
         if self.game.player.hp <= 0:
@@ -400,8 +629,13 @@ class GameManager:
         self.send(response)
 
     def send_player_data(self):
-        player_data = {'data': self.game.player.encode()}
-        response = self.DataPacket(self.DataPacket.CLIENT_PLAYER_INFO, player_data)
+        data = self.game.player.encode()
+        frame = self.game.player.animation_frame()
+        now = time()
+        if not self.player_info_sender.due(data, frame, now):
+            return
+        self.player_info_sender.sent(data, frame, now)
+        response = self.DataPacket(self.DataPacket.CLIENT_PLAYER_INFO, {'data': data})
         self.send(response)
 
     def send(self, data_packet):
@@ -418,7 +652,8 @@ class GameManager:
         return self.network.receive()
 
     def draw(self, screen: pygame.Surface):
-        self.packet_received = self.receive()
+        with frame_profiler.section('network'):
+            self.packet_received = self.receive()
         if self.game is None:
             LoadingScreen().draw(screen)
         else:
@@ -458,17 +693,24 @@ def validate_address(user_input):
 
 
 def main(screen):
-    current_screen = Menu()
-    game_manager = GameManager()
+    with profiler.section('menu'):
+        current_screen = Menu()
+        game_manager = GameManager()
 
     if WEBCAM:
-        ScriptManager.run_subprocess()
+        with profiler.section('webcam subprocess'):
+            ScriptManager.run_subprocess()
+
+    frame_overlay = FrameTimeOverlay(frame_profiler)
 
     run = True
-    SoundCore.main_menu_music.music_play()
+    with profiler.section('menu music'):
+        SoundCore.main_menu_music.music_play()
     while run:
         clock.tick(MAX_FPS)
+        frame_profiler.begin_frame()
         for event in pygame.event.get():
+            frame_overlay.event_handle(event)
             if event.type == pygame.QUIT:
                 ServerManager.kill_subprocess()
                 ScriptManager.kill_subprocess()
@@ -560,8 +802,13 @@ def main(screen):
             current_screen.draw(screen)
         except Exception as e:
             current_screen = MessageScreen(str(e), pygame.event.Event(OPEN_MAIN_MENU_EVENT))
+        with frame_profiler.section('overlay'):
+            frame_overlay.draw(screen)
         pygame.display.set_caption(f"{int(clock.get_fps())} FPS")
-        pygame.display.flip()
+        with frame_profiler.section('flip'):
+            pygame.display.flip()
+        frame_profiler.end_frame()
+        profiler.report()
     pygame.mixer.quit()
     pygame.quit()
 
@@ -570,15 +817,16 @@ if __name__ == "__main__":
     pygame.init()
     pygame.mixer.init()
 
-    if FULLSCREEN:
-        config.HEIGHT = pygame.display.Info().current_h
-        config.WIDTH = pygame.display.Info().current_w
-        WIDTH = config.WIDTH
-        HEIGHT = config.HEIGHT
-        screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.FULLSCREEN)
+    with profiler.section('display'):
+        if FULLSCREEN:
+            config.HEIGHT = pygame.display.Info().current_h
+            config.WIDTH = pygame.display.Info().current_w
+            WIDTH = config.WIDTH
+            HEIGHT = config.HEIGHT
+            screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.FULLSCREEN)
 
-    else:
-        screen = pygame.display.set_mode((WIDTH, HEIGHT))
+        else:
+            screen = pygame.display.set_mode((WIDTH, HEIGHT))
 
     clock = pygame.time.Clock()
     main(screen)
@@ -6,6 +6,7 @@ import socket
 from time import time
 
 from config import WEBCAM, WEBCAM_SERVER_PORT
+from frame_profiler import frame_profiler
 
 
 class DataPacket:
@@ -13,16 +14,14 @@ class DataPacket:
     INITIAL_INFO = 2
     GAME_STATE = 3
     DISCONNECT = 4
-    GAME_INFO = 5
     PLAYERS_INFO = 6
     CLIENT_PLAYER_INFO = 7
     ADD_PLAYER_FLAG = 8
     REMOVE_PLAYER_FLAG = 9
-    NEW_SHOT_FROM_CLIENT = 10
-    NEW_SHOT_FROM_SERVER = 11
-    DELETE_BULLET_FROM_SERVER = 12
+    NEW_VOLLEY_FROM_CLIENT = 10
+    NEW_VOLLEY_FROM_SERVER = 11
+    DELETE_BULLETS_FROM_SERVER = 12
     HEALTH_POINTS = 13
-    NEW_WEAPON_FROM_SERVER = 14
     CLIENT_PICKED_WEAPON = 15
     CLIENT_DROPPED_WEAPON = 16
     CLIENT_PICK_WEAPON_REQUEST = 17
@@ -32,9 +31,17 @@ class DataPacket:
     WEBCAM_READY = 21
     RELOAD_WEAPON = 22
     PING = 23
+    LEVEL_BOOTSTRAP = 24
+    NEXT_LEVEL = 25
+    HITSCAN_FROM_SERVER = 26
+
+    # Каждый следующий пакет этих типов полностью заменяет предыдущий, из пачки нужен только последний
+    SUPERSEDING_TYPES = {PLAYERS_INFO, HEALTH_POINTS}
 
     FLAG_READY = 100
 
+    BOOTSTRAP_VERSION = 1
+
     delimiter_byte = b'\n'
 
     def __init__(self, data_type, data=None, headers=None):
@@ -62,11 +69,25 @@ class DataPacket:
         return json.dumps(datagram).encode() + DataPacket.delimiter_byte
 
 
+def coalesce(batch: list[tuple]) -> list[tuple]:
+    # batch - кортежи, первым элементом которых идёт DataPacket. Из пакетов SUPERSEDING_TYPES
+    # остаётся только последний каждого типа, он стоит на своём месте среди остальных
+    latest = dict()
+    for index, item in enumerate(batch):
+        if item[0].data_type in DataPacket.SUPERSEDING_TYPES:
+            latest[item[0].data_type] = index
+    return [item for index, item in enumerate(batch)
+            if item[0].data_type not in DataPacket.SUPERSEDING_TYPES or latest[item[0].data_type] == index]
+
+
 class Network:
     start_time = int(time())
 
     def __init__(self, server, port, callback):
         self.last_udp_packet_time = 0
+        self.udp_packets_received = 0
+        self.packets_received = 0
+        self.packets_coalesced = 0
 
         self.callback = callback
         self.server = server
@@ -94,10 +115,23 @@ class Network:
         self.sel.register(self.tcp_local_socket, selectors.EVENT_READ, self.callback)
 
         self.id = -1
+        self.record_file = None
+        self.record_start = 0
 
     def __del__(self):
         self.tcp_client_socket.close()
         self.udp_client_socket.close()
+        if self.record_file is not None:
+            self.record_file.close()
+
+    def start_recording(self, path: str):
+        # Принятые пакеты пишутся по строке с временем приёма, benchmarks/render_benchmark.py умеет их проигрывать
+        self.record_file = open(path, 'w')
+        self.record_start = time()
+
+    def record(self, data_packet: DataPacket):
+        line = [round(time() - self.record_start, 4), data_packet.data_type, data_packet.data, data_packet.headers]
+        self.record_file.write(json.dumps(line) + '\n')
 
     def authorize(self):
         if WEBCAM:
@@ -125,6 +159,7 @@ class Network:
         if sock.type == socket.SOCK_DGRAM:
             data = sock.recv(1024)
             data_packet = DataPacket.from_bytes(data)
+            self.udp_packets_received += 1
             if data_packet.headers['time'] < self.last_udp_packet_time:
                 return None
             self.last_udp_packet_time = data_packet.headers['time']
@@ -143,8 +178,9 @@ class Network:
             return DataPacket.from_bytes(data)
 
     def receive(self):
-        received = False
-
+        # Сначала вычитывается всё, что пришло, потом устаревшие пакеты состояния выбрасываются,
+        # а остальные отдаются в callback в порядке прихода
+        batch = []
         while True:
             events = self.sel.select(timeout=0)
             if not events:
@@ -152,8 +188,18 @@ class Network:
             for key, mask in events:
                 data_packet = self.read_packet(key.fileobj)
                 if data_packet is not None:
-                    received = True
-                    callback = key.data
-                    callback(data_packet, mask)
-
-        return received
+                    if self.record_file is not None:
+                        self.record(data_packet)
+                    batch.append((data_packet, key.data, mask))
+
+        kept = coalesce(batch)
+        for data_packet, callback, mask in kept:
+            with frame_profiler.section('callbacks'):
+                callback(data_packet, mask)
+
+        coalesced = len(batch) - len(kept)
+        self.packets_received += len(batch)
+        self.packets_coalesced += coalesced
+        frame_profiler.count('packets', len(batch))
+        frame_profiler.count('coalesced', coalesced)
+        return bool(batch)
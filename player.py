@@ -1,11 +1,26 @@
 import os
+import threading
 
 import pygame
 import yaml
+
+from assets import Atlas, add_flipped, load_frames
 from weapon import Weapon
 
 
-def load_character_sprites(name: str, scale: int) -> (dict[str, list[pygame.surface.Surface]], dict[str, int]):
+character_sprites: dict[tuple[str, int], tuple[Atlas, dict[str, int]]] = dict()
+character_sprites_lock = threading.Lock()  # Спрайты грузит и главный поток, и LevelPreloader
+
+
+def load_character_sprites(name: str, scale: int) -> (Atlas, dict[str, int]):
+    # Спрайты персонажа загружаются один раз на процесс, игроки делят их между собой
+    with character_sprites_lock:
+        if (name, scale) not in character_sprites:
+            character_sprites[(name, scale)] = read_character_sprites(name, scale)
+        return character_sprites[(name, scale)]
+
+
+def read_character_sprites(name: str, scale: int) -> (Atlas, dict[str, int]):
     path = os.path.join("data", "PlayerSprites", name)
     ch_data = {}
     with open(os.path.join(path, '_config.yaml'), "r") as stream:
@@ -19,29 +34,22 @@ def load_character_sprites(name: str, scale: int) -> (dict[str, list[pygame.surf
         except yaml.YAMLError as exc:
             print(exc)
 
-    sprites_dict: dict[str, list[pygame.surface.Surface]] = dict()
+    frames: dict[str, list[pygame.surface.Surface]] = dict()
     for filename in os.listdir(path):
         if '.png' not in filename:
             continue
         state = filename.replace('.png', '')
-        sprites_dict[state + "_right"] = []
-        sprites_dict[state + "_left"] = []
-        sprite_sheet = pygame.image.load(os.path.join(path, filename))
-        sprites_count = sprite_sheet.get_width() // ch_data['RECT_WIDTH']
-        for i in range(sprites_count):
-            sprite = sprite_sheet.subsurface((ch_data['RECT_WIDTH'] * i, 0),
-                                             (ch_data['RECT_WIDTH'], ch_data['RECT_HEIGHT']))
-            sprite = pygame.transform.scale(sprite, (ch_data['RECT_WIDTH'] * scale, ch_data['RECT_HEIGHT'] * scale))
-            sprites_dict[state + "_right"].append(sprite)
-            sprites_dict[state + "_left"].append(pygame.transform.flip(sprite, True, False))
+        add_flipped(frames, state, load_frames(os.path.join(path, filename),
+                                               ch_data['RECT_WIDTH'], ch_data['RECT_HEIGHT'], scale))
 
-    return sprites_dict, ch_data
+    return Atlas(frames), ch_data
 
 
 class Player:
     def __init__(self, pos, scale, name, color=(255, 255, 255)):
 
-        self.sprites, self.ch_data = load_character_sprites(name, scale)
+        self.base_sprites, self.ch_data = load_character_sprites(name, scale)
+        self.sprites = self.base_sprites
         self.set_color(color)
         self.color = color
 
@@ -74,6 +82,8 @@ class Player:
 
         self.status = 'idle'
         self.direction = 'right'
+        # Кадр может быть нарисован раньше первого шага симуляции
+        self.sprite = self.sprites[f'{self.status}_{self.direction}'][0]
 
         self.sprite_animation_counter = 0
 
@@ -82,11 +92,7 @@ class Player:
 
     def set_color(self, color):
         self.color = color
-        for sprites_list in self.sprites.values():
-            for sprite in sprites_list:
-                colorImage = pygame.Surface(sprite.get_size()).convert_alpha()
-                colorImage.fill(color)
-                sprite.blit(colorImage, (0, 0), special_flags=pygame.BLEND_RGBA_MULT)
+        self.sprites = self.base_sprites.tinted(color)
 
     def get_position(self):
         x = self.x + self.ch_data['RECT_WIDTH'] // 2
@@ -121,7 +127,7 @@ class Player:
             self.status = 'run'
 
         sprite_name = self.status + '_' + self.direction
-        sprite_index = int((self.sprite_animation_counter // self.sprites_change_rate) % len(self.sprites[sprite_name]))
+        sprite_index = self.animation_frame()
         self.sprite = self.sprites[sprite_name][sprite_index]
 
         if self.status == 'deathNoMovement' and sprite_index == len(self.sprites[sprite_name]) - 1:
@@ -165,6 +171,9 @@ class Player:
     def touch_ceil(self):
         self.vy *= -1
 
+    def get_hitbox(self) -> tuple[float, float, int, int]:
+        return self.x + self.sprite_offset_x, self.y + self.sprite_offset_y, self.width, self.height
+
     def get_left(self):
         return self.rect.left + (self.ch_data['RECT_WIDTH'] - self.ch_data['CHARACTER_WIDTH']) // 2
 
@@ -199,13 +208,18 @@ class Player:
         self.update_sprite(time_delta)
         self.vy += min(1, self.off_ground_counter) * time_delta * 2000
         self.off_ground_counter += 1
-        self.move(self.vx * time_delta, self.vy * time_delta)
+        # Перемещение с учётом столкновений делает Game.move_player
+        return self.vx * time_delta, self.vy * time_delta
 
     def draw(self, screen, offset_x, offset_y):
         screen.blit(self.sprite, (self.rect.x + offset_x, self.rect.y + offset_y))
         if self.hp > 0:
             self.weapon.draw(screen, offset_x, offset_y)
 
+    def animation_frame(self) -> int:
+        sprite_name = self.status + '_' + self.direction
+        return int((self.sprite_animation_counter // self.sprites_change_rate) % len(self.sprites[sprite_name]))
+
     def encode(self):
         return [self.rect.x, self.rect.y, self.status, self.direction, round(self.sprite_animation_counter, 2),
                 self.hp, self.vx, self.vy, self.off_ground_counter]
@@ -224,8 +238,7 @@ class Player:
         self.sprite_animation_counter = data[4] - 1
         self.hp = data[5]
         sprite_name = self.status + '_' + self.direction
-        sprite_index = (self.sprite_animation_counter // self.sprites_change_rate) % len(self.sprites[sprite_name])
-        self.sprite = self.sprites[sprite_name][int(sprite_index)]
+        self.sprite = self.sprites[sprite_name][self.animation_frame()]
         self.vx = data[6]
         self.vy = data[7]
         self.off_ground_counter = data[8]
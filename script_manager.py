@@ -1,15 +1,19 @@
 from multiprocessing import Process
 
-from script import run
-
 
 class ScriptManager:
     process: Process = Process()
 
+    @staticmethod
+    def run_script():
+        # cv2 и ultralytics нужны только процессу с камерой
+        from script import run
+        run()
+
     @staticmethod
     def run_subprocess():
         ScriptManager.kill_subprocess()
-        ScriptManager.process = Process(target=run)
+        ScriptManager.process = Process(target=ScriptManager.run_script)
         ScriptManager.process.start()
 
     @staticmethod
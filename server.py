@@ -7,13 +7,21 @@ from random import shuffle, choice
 import pygame
 
 from colors import color_generator
-from level import Level, GameObjectPoint
+from level import Level, GameObjectPoint, level_cache
 from network import DataPacket
-from weapon import Weapon
+from weapon import Weapon, Bullet, RestingBody
 
 DEBUG = True
 TICK_RATE = 240
-POSITIONS_SEND_RATE = 120
+POSITIONS_SEND_RATE = 120  # Не больше стольких снимков в секунду одному клиенту
+MIN_POSITIONS_SEND_RATE = 20
+POSITIONS_SEND_BUDGET = 360  # Снимков в секунду на всех клиентов вместе
+GOOD_RTT = 0.06  # Секунды, соединения с меньшим RTT не ограничиваются
+PING_INTERVAL = 1
+IDLE_TIMEOUT = 2  # Секунды без изменений, после которых сессия засыпает
+IDLE_WAKE_RATE = 2  # Обновлений в секунду во сне
+IDLE_PING_INTERVAL = 3
+LEVEL_STREAM_RADIUS = 512  # Чанки уровня ближе этого к игрокам и падающему оружию остаются загруженными
 
 ADDRESS = ('127.0.0.1', 5555)
 
@@ -78,11 +86,14 @@ class ServerPlayer:
     def from_player_data(player_id, data) -> ServerPlayer:
         return ServerPlayer(player_id, *data)
 
-    def apply(self, data) -> None:
+    def apply(self, data) -> bool:
+        changed = (self.x, self.y, self.status, self.direction, self.vx, self.vy) != \
+                  (data[0], data[1], data[2], data[3], data[6], data[7])
         self.x, self.y, self.status, self.direction, self.sprite_animation_counter, self.hp, \
             self.vx, self.vy, self.off_ground_counter = data
         self.sprite_rect.x = self.x + self.sprite_offset_x
         self.sprite_rect.y = self.y + self.sprite_offset_y
+        return changed
 
     def get_center(self) -> tuple[int, int]:
         return self.sprite_rect.x + self.ch_data['CHARACTER_WIDTH'] // 2, self.sprite_rect.bottom
@@ -105,11 +116,7 @@ class ServerBullet:
         self.vx, self.vy = v
         self.damage = damage
         self.current_lifetime_seconds = 0
-        self.max_lifetime_seconds = 1
-
-    @staticmethod
-    def from_data(owner: int, data: list):
-        return ServerBullet(owner, *data)
+        self.max_lifetime_seconds = Bullet.MAX_LIFETIME_SECONDS
 
     def update(self, timedelta: int) -> None:
         self.vy += self.ay
@@ -121,13 +128,15 @@ class ServerBullet:
         return self.x, self.y
 
 
-class ServerWeapon:
+class ServerWeapon(RestingBody):
     weapon_id = 0
 
     def __init__(self, name, x, y):
         self.owner = None
         self.name = name
         self.vy = 0
+        self.sleeping = False
+        self.resting_steps = 0
 
         self.ammo = Weapon.all_weapons_info[self.name]['PATRONS']
 
@@ -152,19 +161,17 @@ class ServerWeapon:
             self.rect.x = self.owner.x + Weapon.all_weapons_info[self.name][f'OFFSET_X_{self.direction.upper()}']
             self.rect.y = self.owner.y + Weapon.all_weapons_info[self.name]['OFFSET_Y']
         else:
-            dvy = 128
-            dy = int(time_delta * self.vy)
-            self.rect.y += dy
-            if level.collide_point(*self.get_center()):
-                self.rect.y -= dy
-                self.vy = 0
-            else:
-                self.vy += dvy
-                self.vy = min(self.vy, 512)
+            self.fall(time_delta, level)
+
+    def shift_y(self, dy):
+        self.rect.y += dy
 
     def reload(self):
         self.ammo = Weapon.all_weapons_info[self.name]['PATRONS']
 
+    def is_resting(self) -> bool:
+        return self.owner is not None or self.sleeping
+
     def get_center(self) -> tuple[int, int]:
         if self.direction == 'right':
             return self.rect.x + self.center_offset_x, self.rect.y + self.bottom_offset_y
@@ -175,11 +182,66 @@ class ServerWeapon:
         return [self.name, self.rect.x, self.rect.y, self.ammo]
 
 
+class ClientLink:
+    def __init__(self):
+        self.rtt = 0
+        self.loss = 0
+        self.fps = POSITIONS_SEND_RATE
+
+        self.target_rate = POSITIONS_SEND_RATE
+        self.snapshot_rate = POSITIONS_SEND_RATE
+        self.next_snapshot_time = 0
+
+        self.snapshots_sent = 0
+        self.ping_time = 0
+        self.snapshots_sent_at_ping = 0
+        self.last_report: tuple[int, int] | None = None  # (отправлено, получено) на прошлом пинге
+
+    def ping_sent(self) -> None:
+        self.ping_time = time.time()
+        self.snapshots_sent_at_ping = self.snapshots_sent
+
+    def ping_received(self, data) -> None:
+        if self.ping_time:
+            self.rtt = 0.8 * self.rtt + 0.2 * (time.time() - self.ping_time)
+
+        if not isinstance(data, dict) or 'udp_received' not in data:
+            return
+        self.fps = data['fps']
+
+        report = (self.snapshots_sent_at_ping, data['udp_received'])
+        if self.last_report is not None:
+            sent = report[0] - self.last_report[0]
+            received = report[1] - self.last_report[1]
+            if sent > 0:
+                loss = min(1, max(0, 1 - received / sent))
+                self.loss = 0.7 * self.loss + 0.3 * loss
+        self.last_report = report
+
+        self.target_rate = self.compute_rate()
+
+    def compute_rate(self) -> float:
+        rate = min(POSITIONS_SEND_RATE, max(MIN_POSITIONS_SEND_RATE, self.fps))
+        rate *= 1 - self.loss
+        if self.rtt > GOOD_RTT:
+            rate *= GOOD_RTT / self.rtt
+        return min(POSITIONS_SEND_RATE, max(MIN_POSITIONS_SEND_RATE, rate))
+
+    def snapshot_due(self, now: float) -> bool:
+        if now < self.next_snapshot_time:
+            return False
+        self.next_snapshot_time = max(self.next_snapshot_time + 1 / self.snapshot_rate, now)
+        self.snapshots_sent += 1
+        return True
+
+
 class GameState:
     STATUS_WAIT = 1
     STATUS_CONNECTED = 2
     STATUS_PLAYING = 3
     MAX_LEVELS = 10
+    LOBBY_LEVEL = 'lobby'
+    FINAL_LEVEL = 'lastmap'
 
     def __init__(self):
         self.level_id = 0
@@ -188,10 +250,12 @@ class GameState:
         self.players_alive: set[int] = set()
         self.bullets: dict[int, ServerBullet] = dict()
         self.weapons: dict[int, ServerWeapon] = dict()
+        self.awake_weapons: set[int] = set()
 
-        self.level_name: str = 'lobby'
+        self.level_name: str = GameState.LOBBY_LEVEL
+        self.next_level_name: str = choice(level_names)
         self.lastlevel: bool = False
-        self.level: Level = Level(self.level_name)
+        self.level: Level = level_cache.get(self.level_name)
         self.spawn_points: list[GameObjectPoint] = []
         self.current_spawn_point: int = 0
         self.change_level(self.level_name)
@@ -211,17 +275,49 @@ class GameState:
 
         self.bullets.clear()
         self.weapons.clear()
+        self.awake_weapons.clear()
         ServerBullet.bullet_id = 0
         ServerWeapon.weapon_id = 0
 
-        self.level = Level(level_name)
+        self.level = level_cache.get(level_name)
+        self.level.reset()
         for point in self.level.objects['points']:
             if point.name == 'spawnpoint':
                 self.spawn_points.append(point)
             if 'Weapon' in point.name:
                 self.weapons[ServerWeapon.weapon_id] = ServerWeapon(point.name, point.x, point.y)
+                self.awake_weapons.add(ServerWeapon.weapon_id)
                 ServerWeapon.weapon_id += 1
 
+        if self.level_id == GameState.MAX_LEVELS:
+            self.next_level_name = GameState.FINAL_LEVEL
+        else:
+            self.next_level_name = choice(level_names)
+
+    def wake_weapon(self, weapon_id: int) -> None:
+        self.weapons[weapon_id].wake()
+        self.awake_weapons.add(weapon_id)
+
+    def update_weapons(self, time_delta) -> None:
+        # Анимации уровня идут и на сервере, иначе changed_rects всегда пуст и оружие на
+        # анимированных твёрдых тайлах не просыпается, как у клиентов
+        self.level.update(time_delta)
+        for weapon_id in list(self.awake_weapons):
+            weapon = self.weapons[weapon_id]
+            weapon.update(time_delta, self.level)
+            if weapon.owner is None and weapon.sleeping:
+                self.awake_weapons.remove(weapon_id)
+
+        if self.level.changed_rects:
+            for weapon_id, weapon in self.weapons.items():
+                if weapon.sleeping and weapon.wake_near(self.level.changed_rects):
+                    self.awake_weapons.add(weapon_id)
+
+    def stream_level(self) -> None:
+        points = [player.get_center() for player in self.players.values()]
+        points += [self.weapons[weapon_id].get_center() for weapon_id in self.awake_weapons]
+        self.level.load_around(points, LEVEL_STREAM_RADIUS)
+
     def get_spawn_point(self) -> tuple[int, int]:
         spawn_point = self.spawn_points[self.current_spawn_point]
         self.current_spawn_point = (self.current_spawn_point + 1) % len(self.spawn_points)
@@ -395,7 +491,13 @@ class GameSession:
         self.game_statistics = GameStatistics()
         self.game_state = GameState()
         self.client_last_ping = dict()
+        self.client_links: dict[int, ClientLink] = dict()
         self.session_ended = False
+        self.deleted_bullets: list[int] = []  # Уходят клиентам одним пакетом в конце тика
+
+        self.idle = False
+        self.last_activity_time = time.time()
+        self.wake_event = asyncio.Event()
 
     @classmethod
     async def create(cls, address: tuple[str, int]):
@@ -407,6 +509,7 @@ class GameSession:
     # noinspection PyAttributeOutsideInit
     async def start(self, address: tuple[str, int]):
         self.server_network = await ServerNetwork.create(self.events_queue, address)
+        self.prefetch_next_level()
 
         events_handler = asyncio.create_task(self.events_listener())
         players_data_sender = asyncio.create_task(self.players_data_sender())
@@ -432,17 +535,46 @@ class GameSession:
                                    delay=delay_seconds)
         self.events_queue.put_nowait(server_event)
 
+    def wake(self):
+        self.last_activity_time = time.time()
+        if self.idle:
+            self.idle = False
+            self.wake_event.set()
+
+    def update_idle_state(self):
+        falling_weapons = any(not self.game_state.weapons[weapon_id].is_resting()
+                              for weapon_id in self.game_state.awake_weapons)
+        if self.game_state.bullets or falling_weapons:
+            self.wake()
+            return
+
+        if not self.idle and time.time() - self.last_activity_time > IDLE_TIMEOUT:
+            self.idle = True
+            self.wake_event.clear()
+
+    async def scheduler_sleep(self, interval, idle_interval):
+        if not self.idle:
+            await asyncio.sleep(interval)
+            return
+        # Во сне циклы просыпаются редко, но wake() сразу возвращает им полную частоту
+        try:
+            await asyncio.wait_for(self.wake_event.wait(), timeout=max(interval, idle_interval))
+        except asyncio.TimeoutError:
+            pass
+
     async def ping_players(self):
         while not self.session_ended:
             for client_id in self.game_state.players.keys():
                 self.send_packet_tcp(client_id, DataPacket(DataPacket.PING))
-            await asyncio.sleep(1)
+                if client_id in self.client_links.keys():
+                    self.client_links[client_id].ping_sent()
+            await self.scheduler_sleep(PING_INTERVAL, IDLE_PING_INTERVAL)
 
     async def players_data_sender(self):
         while not self.session_ended:
             server_event = ServerEvent(event_type=ServerEvent.SEND_PLAYERS_DATA)
             self.events_queue.put_nowait(server_event)
-            await asyncio.sleep(1 / POSITIONS_SEND_RATE)
+            await self.scheduler_sleep(1 / POSITIONS_SEND_RATE, 1 / IDLE_WAKE_RATE)
 
     async def game_state_updater(self):
         last_tick = time.time()
@@ -453,15 +585,19 @@ class GameSession:
             server_event = ServerEvent(event_type=ServerEvent.UPDATE_GAME_STATE,
                                        data={'time_delta': time_delta})
             self.events_queue.put_nowait(server_event)
-            await asyncio.sleep(1 / TICK_RATE)
+            was_idle = self.idle
+            await self.scheduler_sleep(1 / TICK_RATE, 1 / IDLE_WAKE_RATE)
+            if was_idle:
+                # Время простоя не идёт в шаг, иначе только что созданные пули перепрыгнут стены и игроков
+                last_tick = time.time() - 1 / TICK_RATE
 
     async def events_listener(self):
         while not self.session_ended:
             server_event = await self.events_queue.get()
 
             if server_event.time > time.time():
-                self.events_queue.put_nowait(server_event)
-                await asyncio.sleep(0)
+                asyncio.get_running_loop().call_later(server_event.time - time.time(),
+                                                      self.events_queue.put_nowait, server_event)
                 continue
 
             if server_event.event_type == ServerEvent.KILL_SERVER:
@@ -476,6 +612,9 @@ class GameSession:
                 self.server_network.id_to_stream[client_id] = (reader, writer)
                 self.server_network.stream_to_id[(reader, writer)] = client_id
                 self.client_last_ping[client_id] = time.time()
+                self.client_links[client_id] = ClientLink()
+                self.rebalance_snapshot_rates()
+                self.wake()
 
                 if self.game_state.game_started or len(self.game_state.players) >= 4:
                     response = DataPacket(data_type=DataPacket.GAME_ALREADY_STARTED)
@@ -502,7 +641,11 @@ class GameSession:
                     self.server_network.id_to_udp_address.pop(client_id)
                 if client_id in self.client_last_ping.keys():
                     self.client_last_ping.pop(client_id)
+                if client_id in self.client_links.keys():
+                    self.client_links.pop(client_id)
+                    self.rebalance_snapshot_rates()
 
+                self.wake()
                 print(f'client with id {client_id} disconnected')
                 writer.close()
                 try:
@@ -513,6 +656,7 @@ class GameSession:
             if server_event.event_type == ServerEvent.UPDATE_GAME_STATE:
                 time_delta = server_event['time_delta']
                 self.update_game_state(time_delta)
+                self.update_idle_state()
 
             if server_event.event_type == ServerEvent.SEND_PLAYERS_DATA:
                 players_data = dict()
@@ -522,12 +666,16 @@ class GameSession:
                     players_data[player_id] = self.game_state.players[player_id].encode()
                 response = DataPacket(data_type=DataPacket.PLAYERS_INFO, data=players_data)
 
+                now = time.time()
                 for client_id in self.server_network.id_to_udp_address.keys():
+                    if client_id in self.client_links.keys() and not self.client_links[client_id].snapshot_due(now):
+                        continue
                     self.send_packet_udp(client_id, response)
 
             if server_event.event_type == ServerEvent.CHANGE_LEVEL:
                 level_name = server_event['level_name']
                 self.change_level(level_name)
+                self.wake()
 
             if server_event.event_type == ServerEvent.SEND_TCP:
                 client_id: int = server_event['client_id']
@@ -542,10 +690,7 @@ class GameSession:
             if server_event.event_type == ServerEvent.SEND_INITIAL_GAME_INFO:
                 client_id: int = server_event['client_id']
 
-                response_data = {'level_name': 'lobby',
-                                 'position': self.game_state.get_spawn_point(),
-                                 'color': color_generator.__next__()}
-                response = DataPacket(data_type=DataPacket.GAME_INFO, data=response_data)
+                response = self.level_bootstrap(self.game_state.get_spawn_point(), color_generator.__next__())
                 self.send_packet_tcp(client_id, response)
 
             if server_event.event_type == ServerEvent.HANDLE_PACKET:
@@ -581,6 +726,11 @@ class GameSession:
 
         if data_packet.data_type == DataPacket.PING:
             self.client_last_ping[client_id] = time.time()
+            if client_id in self.client_links.keys():
+                self.client_links[client_id].ping_received(data_packet.data)
+                self.rebalance_snapshot_rates()
+        elif data_packet.data_type != DataPacket.CLIENT_PLAYER_INFO:
+            self.wake()
 
         if data_packet.data_type == DataPacket.INITIAL_INFO:
             data = data_packet['data']
@@ -591,7 +741,8 @@ class GameSession:
         if data_packet.data_type == DataPacket.CLIENT_PLAYER_INFO:
             if GameState.STATUS_PLAYING in self.game_state.players[client_id].flags:
                 data = data_packet['data']
-                self.game_state.players[client_id].apply(data)
+                if self.game_state.players[client_id].apply(data):
+                    self.wake()
 
         if data_packet.data_type == DataPacket.RELOAD_WEAPON:
             weapon_id = self.game_state.players[client_id].weapon_id
@@ -609,15 +760,25 @@ class GameSession:
             if flag in self.game_state.players[client_id].flags:
                 self.game_state.players[client_id].flags.remove(flag)
 
-        if data_packet.data_type == DataPacket.NEW_SHOT_FROM_CLIENT:
-            bullet_data = data_packet['data']
-            bullet = ServerBullet.from_data(client_id, bullet_data)
-            bullet_id = ServerBullet.bullet_id
-            ServerBullet.bullet_id += 1
-
-            self.game_state.bullets[bullet_id] = bullet
-
-            response = DataPacket(DataPacket.NEW_SHOT_FROM_SERVER, [client_id, bullet_id, bullet_data])
+        if data_packet.data_type == DataPacket.NEW_VOLLEY_FROM_CLIENT:
+            volley_data = data_packet['data']
+            position, direction, weapon_name, seed = volley_data
+            damage = Weapon.all_weapons_info[weapon_name]['BULLET_DAMAGE']
+            ay = Weapon.all_weapons_info[weapon_name]['BULLET_Y_ACCELERATION']
+
+            if Weapon.is_hitscan(weapon_name):
+                # Лучи считаются сразу, клиенты получают только концы лучей и тех, в кого попали
+                rays = [self.cast_hitscan(client_id, position, speed, damage)
+                        for speed in Weapon.volley_speeds(weapon_name, direction, seed)]
+                response = DataPacket(DataPacket.HITSCAN_FROM_SERVER, [client_id, volley_data, rays])
+            else:
+                # Клиенты восстанавливают те же дробинки по зерну, id им выдаются подряд
+                first_bullet_id = ServerBullet.bullet_id
+                for speed in Weapon.volley_speeds(weapon_name, direction, seed):
+                    bullet = ServerBullet(client_id, position, speed, damage, ay)
+                    self.game_state.bullets[ServerBullet.bullet_id] = bullet
+                    ServerBullet.bullet_id += 1
+                response = DataPacket(DataPacket.NEW_VOLLEY_FROM_SERVER, [client_id, first_bullet_id, volley_data])
             for client_id in self.game_state.players.keys():
                 self.send_packet_tcp(client_id, response)
 
@@ -637,6 +798,7 @@ class GameSession:
 
             if closest_weapon_id is not None:
                 self.game_state.weapons[closest_weapon_id].owner = self.game_state.players[client_id]
+                self.game_state.wake_weapon(closest_weapon_id)
                 self.game_state.players[client_id].weapon_id = closest_weapon_id
                 response = DataPacket(data_type=DataPacket.CLIENT_PICKED_WEAPON,
                                       data={'owner_id': client_id, 'weapon_id': closest_weapon_id})
@@ -651,6 +813,7 @@ class GameSession:
             self.game_state.weapons[weapon_id].owner = None
             self.game_state.weapons[weapon_id].rect.x, self.game_state.weapons[weapon_id].rect.y = weapon_position
             self.game_state.weapons[weapon_id].direction = weapon_direction
+            self.game_state.wake_weapon(weapon_id)
             response = DataPacket(DataPacket.CLIENT_DROPPED_WEAPON,
                                   {'owner_id': client_id,
                                    'weapon_id': weapon_id,
@@ -660,9 +823,67 @@ class GameSession:
             for client_id in self.game_state.players.keys():
                 self.send_packet_tcp(client_id, response)
 
+    def rebalance_snapshot_rates(self):
+        if not self.client_links:
+            return
+        total_rate = sum(link.target_rate for link in self.client_links.values())
+        scale = min(1, POSITIONS_SEND_BUDGET / total_rate)
+        min_rate = min(MIN_POSITIONS_SEND_RATE, POSITIONS_SEND_BUDGET / len(self.client_links))
+        for link in self.client_links.values():
+            link.snapshot_rate = max(min_rate, link.target_rate * scale)
+
+        total_rate = sum(link.snapshot_rate for link in self.client_links.values())
+        if total_rate > POSITIONS_SEND_BUDGET:
+            for link in self.client_links.values():
+                link.snapshot_rate *= POSITIONS_SEND_BUDGET / total_rate
+
+    def prefetch_next_level(self):
+        # Разбор уровня медленный, поэтому следующий грузится в рабочем потоке, пока идёт раунд
+        level_name = self.game_state.next_level_name
+        future = asyncio.get_running_loop().run_in_executor(None, level_cache.get, level_name)
+        future.add_done_callback(lambda done: GameSession.prefetch_done(level_name, done))
+
+    @staticmethod
+    def prefetch_done(level_name, future):
+        # Ошибку покажет и change_level, но здесь она видна заранее и не теряется
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            print(future.exception(), f'<- failed to prefetch level {level_name}')
+
+    def level_bootstrap(self, position, color) -> DataPacket:
+        weapons = dict()
+        for weapon_id, weapon in self.game_state.weapons.items():
+            owner_id = weapon.owner.id if weapon.owner is not None else -1
+            weapons[weapon_id] = {'weapon_data': weapon.encode(), 'owner_id': owner_id}
+
+        players = dict()
+        for player_id, player in self.game_state.players.items():
+            if GameState.STATUS_PLAYING in player.flags:
+                players[player_id] = player.encode()
+
+        response_data = {'version': DataPacket.BOOTSTRAP_VERSION,
+                         'level_id': self.game_state.level_id,
+                         'level_name': self.game_state.level_name,
+                         'position': position,
+                         'color': color,
+                         'weapons': weapons,
+                         'players': players}
+        return DataPacket(data_type=DataPacket.LEVEL_BOOTSTRAP, data=response_data)
+
+    def schedule_level_change(self, level_name, delay):
+        # За время задержки клиенты успевают загрузить уровень, и LEVEL_BOOTSTRAP только подменяет его
+        server_event = ServerEvent(event_type=ServerEvent.CHANGE_LEVEL, data={'level_name': level_name}, delay=delay)
+        self.events_queue.put_nowait(server_event)
+
+        response = DataPacket(DataPacket.NEXT_LEVEL, {'level_name': level_name})
+        for client_id in self.game_state.players.keys():
+            self.send_packet_tcp(client_id, response)
+
     def change_level(self, level_name):
         self.game_state.game_ended = False
         self.game_state.change_level(level_name)
+        self.prefetch_next_level()
 
         players_by_rating = [player for player in self.game_statistics.sort_by_rating() if player in self.game_state.players.keys()]
         spawn_points = [self.game_state.get_spawn_point() for _ in range(len(players_by_rating))]
@@ -670,23 +891,16 @@ class GameSession:
         if not self.game_state.lastlevel:
             shuffle(spawn_points)
 
-        for player_id, spawn_point in zip(players_by_rating, spawn_points):
-            if GameState.STATUS_PLAYING in self.game_state.players[player_id].flags:
-                self.game_state.players[player_id].flags.remove(GameState.STATUS_PLAYING)
+        # Сначала все выходят из игры, чтобы в bootstrap не попали координаты со старого уровня.
+        # Остальных игроков клиент получит обычными снимками, когда они загрузят уровень
+        for player in self.game_state.players.values():
+            player.flags.discard(GameState.STATUS_PLAYING)
 
+        for player_id, spawn_point in zip(players_by_rating, spawn_points):
             player_color = self.game_state.players[player_id].color
-            response_data = {'level_name': level_name,
-                             'position': spawn_point,
-                             'color': player_color}
-
-            response = DataPacket(data_type=DataPacket.GAME_INFO, data=response_data)
+            response = self.level_bootstrap(spawn_point, player_color)
             self.send_packet_tcp(player_id, response)
 
-            for weapon_id, weapon in self.game_state.weapons.items():
-                weapon_data = {'weapon_id': weapon_id, 'weapon_data': weapon.encode()}
-                response = DataPacket(data_type=DataPacket.NEW_WEAPON_FROM_SERVER, data=weapon_data)
-                self.send_packet_tcp(player_id, response)
-
         if self.game_state.lastlevel:
             for player_id in self.game_state.players.keys():
                 response = DataPacket(data_type=DataPacket.DISCONNECT,
@@ -703,11 +917,11 @@ class GameSession:
                 self.events_queue.put_nowait(server_event)
 
         if not self.game_state.players:
-            if self.game_state.level_name != 'lobby':
+            if self.game_state.level_name != GameState.LOBBY_LEVEL:
                 self.game_state.game_ended = False
                 self.game_state.game_started = False
                 server_event = ServerEvent(event_type=ServerEvent.CHANGE_LEVEL,
-                                           data={'level_name': 'lobby'})
+                                           data={'level_name': GameState.LOBBY_LEVEL})
                 self.events_queue.put_nowait(server_event)
             return
 
@@ -715,11 +929,7 @@ class GameSession:
                 and not self.game_state.game_ended and len(self.game_state.players) > 1:
             self.game_state.game_ended = True
             self.game_state.game_started = True
-            level_name = choice(level_names)
-            server_event = ServerEvent(event_type=ServerEvent.CHANGE_LEVEL,
-                                       data={'level_name': level_name},
-                                       delay=2)
-            self.events_queue.put_nowait(server_event)
+            self.schedule_level_change(self.game_state.next_level_name, delay=2)
             return
 
         if len(self.game_state.players) > 1 and len(self.game_state.players_alive) == 1 and not self.game_state.game_ended:
@@ -727,21 +937,11 @@ class GameSession:
             self.game_statistics[self.game_state.players_alive.pop()]['win'] += 1
             if self.game_state.level_id == GameState.MAX_LEVELS:
                 self.game_state.lastlevel = True
-                final_level_name = 'lastmap'
-                server_event = ServerEvent(event_type=ServerEvent.CHANGE_LEVEL,
-                                           data={'level_name': final_level_name},
-                                           delay=1)
-                self.events_queue.put_nowait(server_event)
-            else:
-                level_name = choice(level_names)
-                server_event = ServerEvent(event_type=ServerEvent.CHANGE_LEVEL,
-                                           data={'level_name': level_name},
-                                           delay=1)
-                self.events_queue.put_nowait(server_event)
+            self.schedule_level_change(self.game_state.next_level_name, delay=1)
             return
 
-        for weapon_id in self.game_state.weapons.keys():
-            self.game_state.weapons[weapon_id].update(time_delta, self.game_state.level)
+        self.game_state.update_weapons(time_delta)
+        self.game_state.stream_level()
 
         for client_id in self.game_state.players.keys():
 
@@ -756,9 +956,10 @@ class GameSession:
             bullet = self.game_state.bullets[bullet_id]
             bullet.update(time_delta)
 
+            # Истечение времени и попадание в стену клиенты считают сами по тем же данным уровня
             if bullet.current_lifetime_seconds > bullet.max_lifetime_seconds or \
                     self.game_state.level.collide_point(*bullet.get_position()):
-                self.delete_bullet(bullet_id)
+                self.game_state.bullets.pop(bullet_id)
                 continue
 
             for client_id in self.game_state.players.keys():
@@ -770,26 +971,57 @@ class GameSession:
                 if self.game_state.players[client_id].sprite_rect.collidepoint(bullet.get_position()):
                     if client_id == bullet.owner:
                         continue
-                    self.damage_player(client_id, bullet)
+                    self.damage_player(client_id, bullet.owner, bullet.damage)
                     self.delete_bullet(bullet_id)
+                    break
+
+        self.send_deleted_bullets()
 
     def delete_bullet(self, bullet_id):
         self.game_state.bullets.pop(bullet_id)
+        self.deleted_bullets.append(bullet_id)
+
+    def send_deleted_bullets(self):
+        if not self.deleted_bullets:
+            return
+        data_packet = DataPacket(DataPacket.DELETE_BULLETS_FROM_SERVER, self.deleted_bullets)
         for client_id in self.game_state.players.keys():
-            data_packet = DataPacket(DataPacket.DELETE_BULLET_FROM_SERVER, bullet_id)
             self.send_packet_tcp(client_id, data_packet)
+        self.deleted_bullets = []
+
+    def cast_hitscan(self, owner_id, position, speed, damage) -> list:
+        # Луч до стены, затем ближайший к стволу игрок, через которого он проходит
+        end = Weapon.cast_ray(position, speed, self.game_state.level)
+        start = (round(position[0]), round(position[1]))
+        hit_id, hit_point, hit_distance = None, None, None
+        for player_id, player in self.game_state.players.items():
+            if player_id == owner_id or player_id not in self.game_state.players_alive:
+                continue
+            if GameState.STATUS_PLAYING not in player.flags:
+                continue
+            clipped = player.sprite_rect.clipline(start, (round(end[0]), round(end[1])))
+            if not clipped:
+                continue
+            distance = pygame.math.Vector2(clipped[0]).distance_to(start)
+            if hit_distance is None or distance < hit_distance:
+                hit_id, hit_point, hit_distance = player_id, clipped[0], distance
+
+        if hit_id is not None:
+            end = hit_point
+            self.damage_player(hit_id, owner_id, damage)
+        return [end[0], end[1], hit_id]
 
-    def damage_player(self, player_id, bullet: ServerBullet):
+    def damage_player(self, player_id, owner_id, damage):
         player = self.game_state.players[player_id]
-        damage = min(bullet.damage, player.hp)
-        self.game_statistics[bullet.owner]['damage'] += damage
+        damage = min(damage, player.hp)
+        self.game_statistics[owner_id]['damage'] += damage
         player.hp -= damage
 
         response = DataPacket(DataPacket.HEALTH_POINTS, self.game_state.players[player_id].hp)
         self.send_packet_tcp(player_id, response)
 
         if player.hp == 0:
-            self.game_statistics[bullet.owner]['kill'] += 1
+            self.game_statistics[owner_id]['kill'] += 1
             self.kill_player(player_id)
 
     def kill_player(self, player_id):
@@ -804,6 +1036,7 @@ class GameSession:
         if weapon_id != -1:
             weapon = self.game_state.weapons[weapon_id]
             weapon.owner = None
+            self.game_state.wake_weapon(weapon_id)
             response_data = {'owner_id': player_id,
                              'weapon_id': weapon_id,
                              'weapon_direction': weapon.direction,
@@ -819,33 +1052,9 @@ async def start_session(address: tuple[str, int]):
     game_session = await GameSession.create(address)
 
 
-from multiprocessing import Process
-
-
-class ServerManager:
-    server_process: Process = Process()
-
-    @staticmethod
-    def run_server(address: tuple[str, int]):
-        asyncio.run(start_session(address), debug=DEBUG)
-
-    @staticmethod
-    def run_subprocess(address: tuple[str, int]):
-        ServerManager.kill_subprocess()
-        ServerManager.server_process = Process(target=ServerManager.run_server, args=(address,))
-        ServerManager.server_process.start()
-
-    @staticmethod
-    def kill_subprocess():
-        if ServerManager.server_process.is_alive():
-            ServerManager.server_process.kill()
-
-    @staticmethod
-    def check_server():
-        if ServerManager.server_process.exitcode:
-            ServerManager.server_process = Process()
-            raise Exception("Server upal")
+def run_server(address: tuple[str, int]):
+    asyncio.run(start_session(address), debug=DEBUG)
 
 
 if __name__ == '__main__':
-    ServerManager.run_server(ADDRESS)
+    run_server(ADDRESS)
@@ -0,0 +1,28 @@
+from multiprocessing import Process
+
+
+class ServerManager:
+    server_process: Process = Process()
+
+    @staticmethod
+    def run_server(address: tuple[str, int]):
+        # Модуль сервера тяжёлый, поэтому клиент импортирует его только в процессе сервера
+        from server import run_server
+        run_server(address)
+
+    @staticmethod
+    def run_subprocess(address: tuple[str, int]):
+        ServerManager.kill_subprocess()
+        ServerManager.server_process = Process(target=ServerManager.run_server, args=(address,))
+        ServerManager.server_process.start()
+
+    @staticmethod
+    def kill_subprocess():
+        if ServerManager.server_process.is_alive():
+            ServerManager.server_process.kill()
+
+    @staticmethod
+    def check_server():
+        if ServerManager.server_process.exitcode:
+            ServerManager.server_process = Process()
+            raise Exception("Server upal")
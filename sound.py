@@ -1,3 +1,4 @@
+import hashlib
 import os
 
 import pygame
@@ -26,8 +27,86 @@ except Exception as e:
     print(e, '<-Sound Error')
 
 
+class SoundBank:
+    # Каждый звук декодируется один раз на процесс, сырые PCM-данные кэшируются на диске,
+    # чтобы при следующем запуске не декодировать mp3
+    CACHE_PATH = os.path.join('data', 'cache', 'sounds')
+    CHANNELS = 32
+    MAX_VOICES = 3  # Сколько раз один звук может звучать одновременно
+
+    def __init__(self):
+        self.sounds: dict[str, pygame.mixer.Sound] = dict()
+        self.voices: dict[str, list[pygame.mixer.Channel]] = dict()
+        self.volume = 1.0
+        if pygame.mixer.get_init():
+            pygame.mixer.set_num_channels(SoundBank.CHANNELS)
+
+    @staticmethod
+    def cache_file(path: str) -> str:
+        stat = os.stat(path)
+        key = f'{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}|{pygame.mixer.get_init()}'
+        return os.path.join(SoundBank.CACHE_PATH, hashlib.sha1(key.encode()).hexdigest() + '.pcm')
+
+    def decode(self, path: str) -> pygame.mixer.Sound:
+        cache_file = self.cache_file(path)
+        if os.path.exists(cache_file):
+            with open(cache_file, 'rb') as file:
+                return pygame.mixer.Sound(buffer=file.read())
+
+        sound = pygame.mixer.Sound(path)
+        temporary_path = f'{cache_file}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(SoundBank.CACHE_PATH, exist_ok=True)
+            with open(temporary_path, 'wb') as file:
+                file.write(sound.get_raw())
+            os.replace(temporary_path, cache_file)
+        except OSError as e:
+            print(e, '<- failed to cache sound')
+        return sound
+
+    def get(self, path: str) -> pygame.mixer.Sound | None:
+        if not pygame.mixer.get_init():
+            return None
+        if path not in self.sounds:
+            sound = self.decode(path)
+            sound.set_volume(self.volume)
+            self.sounds[path] = sound
+            self.voices[path] = []
+        return self.sounds[path]
+
+    def play(self, path: str):
+        sound = self.get(path)
+        if sound is None:
+            return
+        voices = [channel for channel in self.voices[path] if channel.get_busy() and channel.get_sound() is sound]
+        if len(voices) >= SoundBank.MAX_VOICES:
+            channel = voices.pop(0)  # Самый старый голос уступает место новому
+            channel.stop()
+        else:
+            channel = pygame.mixer.find_channel()
+            if channel is None:
+                self.voices[path] = voices
+                return
+        channel.play(sound)
+        voices.append(channel)
+        self.voices[path] = voices
+
+    def set_volume(self, volume):
+        self.volume = volume
+        for sound in self.sounds.values():
+            sound.set_volume(volume)
+
+
+sound_bank = SoundBank()
+weapon_sounds: dict[str, dict] = dict()
+
+
 def load_weapon_sound(name,
                       new_names_of_sound=[]):  # передаем название папки с оружием, на выходе - три звука: перезарядка, выстрел, холостой выстрел
+    key = '|'.join([name] + new_names_of_sound)
+    if key in weapon_sounds:
+        return weapon_sounds[key]
+
     path = os.path.join('data', 'WeaponSprites', name, 'sound')
     all_sounds = ['is_empty', 'shot', 'reload'] + new_names_of_sound
     result = {}
@@ -35,27 +114,32 @@ def load_weapon_sound(name,
     for sound_name in all_sounds:
         try:
             result[sound_name] = Sound(os.path.join(path, sound_name + '.mp3'), is_custom=True)
+            # Звуки оружия звучат посреди матча, поэтому декодируются сразу, пока грузится уровень
+            result[sound_name].preload()
         except Exception as e:
             print(e, '<- sound path error')
             result[sound_name] = None
 
+    weapon_sounds[key] = result
     return result
 
 
 class Sound:
     def __init__(self, name, is_custom=False):
-        self.sound = None
-        if not pygame.mixer.get_init():
-            return
         if is_custom:
-            self.sound = pygame.mixer.Sound(name)
+            self.path = name
         else:
-            self.sound = pygame.mixer.Sound(os.path.join('data', 'Sounds', name + '.mp3'))
+            self.path = os.path.join('data', 'Sounds', name + '.mp3')
+        # Звук декодируется банком при первом проигрывании или в preload, а не при запуске
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f'No file \'{self.path}\' found')
+
+    def preload(self):
+        sound_bank.get(self.path)
 
     def sound_play(self):
         if pygame.mixer.get_init() and SoundCore.is_sound_on:
-            self.sound.set_volume(SoundCore.sound_loud)
-            self.sound.play()
+            sound_bank.play(self.path)
 
 
 class Music:
@@ -121,3 +205,8 @@ class SoundCore:
     @staticmethod
     def change_sounds_loud(value):
         SoundCore.sound_loud = value
+        sound_bank.set_volume(value)
+
+
+# Звуки общие для всех, громкость задаётся один раз при изменении
+sound_bank.set_volume(SoundCore.sound_loud)
@@ -0,0 +1,97 @@
+import sys
+import time
+from contextlib import contextmanager
+from importlib.machinery import ExtensionFileLoader, SourceFileLoader, SourcelessFileLoader
+
+'''Профилировщик запуска клиента.
+Включается параметром PROFILE_STARTUP в config.yaml. Считает время импорта каждого модуля
+(собственное и вместе с вложенными импортами) и время этапов инициализации, отчёт печатается
+после первого кадра меню.'''
+
+
+class ImportTimer:
+    # Стоит первым в sys.meta_path: находит модуль обычными средствами и засекает выполнение его кода
+    TIMED_LOADERS = (SourceFileLoader, SourcelessFileLoader, ExtensionFileLoader)
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is None:
+                continue
+            if isinstance(spec.loader, ImportTimer.TIMED_LOADERS):
+                self.wrap(spec.loader, name)
+            return spec
+        return None
+
+    def wrap(self, loader, name):
+        exec_module = loader.exec_module
+        profiler = self.profiler
+
+        def timed_exec_module(module):
+            with profiler.measure('import', name):
+                exec_module(module)
+
+        # Загрузчики файлов создаются на каждый модуль, поэтому подмена метода не задевает другие модули
+        loader.exec_module = timed_exec_module
+
+
+class StartupProfiler:
+    REPORT_LINES = 25
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.enabled = False
+        self.reported = False
+        self.records: list[tuple[str, str, float, float]] = []  # kind, name, self time, total time
+        self.children_time: list[float] = []
+
+    def install(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        self.start = time.perf_counter()
+        sys.meta_path.insert(0, ImportTimer(self))
+
+    @contextmanager
+    def measure(self, kind: str, name: str):
+        self.children_time.append(0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            total = time.perf_counter() - start
+            children = self.children_time.pop()
+            if self.children_time:
+                self.children_time[-1] += total
+            self.records.append((kind, name, total - children, total))
+
+    @contextmanager
+    def section(self, name: str):
+        # Этап инициализации, импорты внутри него попадают в отчёт отдельно
+        if not self.enabled:
+            yield
+            return
+        with self.measure('init', name):
+            yield
+
+    def report(self):
+        if not self.enabled or self.reported:
+            return
+        self.reported = True
+        elapsed = time.perf_counter() - self.start
+        records = sorted(self.records, key=lambda record: record[2], reverse=True)
+
+        print(f'startup: first frame after {elapsed * 1000:.1f} ms')
+        print(f'{"kind":<7}{"self ms":>10}{"total ms":>10}  name')
+        for kind, name, self_time, total in records[:StartupProfiler.REPORT_LINES]:
+            print(f'{kind:<7}{self_time * 1000:>10.1f}{total * 1000:>10.1f}  {name}')
+        imports_time = sum(self_time for kind, _, self_time, _ in self.records if kind == 'import')
+        print(f'startup: {len(self.records)} records, {imports_time * 1000:.1f} ms spent importing')
+
+
+profiler = StartupProfiler()
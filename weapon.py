@@ -1,20 +1,21 @@
 from __future__ import annotations
 
+import math
 import os
 import random
+from typing import Protocol
 
 import pygame
 import yaml
 
+from assets import Atlas, add_flipped, load_frames
 from sound import load_weapon_sound
 
 
-def load_weapon_sprites(scale: int) -> (dict[str, list[pygame.surface.Surface]], dict[str, int]):
+def load_weapon_info() -> dict[str, dict]:
     path = os.path.join("data", 'WeaponSprites')
     weapon_data = {}
-    sprites_dict: dict[str, list[pygame.surface.Surface]] = dict()
-    directories = os.listdir(path)
-    for directory in directories:
+    for directory in os.listdir(path):
         if 'Weapon' not in directory:
             continue
         weapon_data[directory] = dict()
@@ -25,6 +26,13 @@ def load_weapon_sprites(scale: int) -> (dict[str, list[pygame.surface.Surface]],
                     weapon_data[directory][key] = value
             except yaml.YAMLError as exc:
                 print(exc)
+    return weapon_data
+
+
+def load_weapon_sprites(scale: int, weapon_data: dict[str, dict]) -> Atlas:
+    path = os.path.join("data", 'WeaponSprites')
+    frames: dict[str, list[pygame.surface.Surface]] = dict()
+    for directory in weapon_data.keys():
         for filename in os.listdir(os.path.join(path, directory)):
             if '.png' not in filename:
                 continue
@@ -35,20 +43,64 @@ def load_weapon_sprites(scale: int) -> (dict[str, list[pygame.surface.Surface]],
             else:
                 sprite_width = weapon_data[directory]['WEAPON_RECT_WIDTH']
                 sprite_height = weapon_data[directory]['WEAPON_RECT_HEIGHT']
-            sprites_dict[f'{directory}_{state}_right'] = []
-            sprites_dict[f'{directory}_{state}_left'] = []
-            sprite_sheet = pygame.image.load(os.path.join(path, directory, filename))
-            sprites_count = sprite_sheet.get_width() // sprite_width
-            for i in range(sprites_count):
-                sprite = sprite_sheet.subsurface((sprite_width * i, 0), (sprite_width, sprite_height))
-                sprite = pygame.transform.scale(sprite, (sprite_width * scale, sprite_height * scale))
-                sprites_dict[f'{directory}_{state}_right'].append(sprite)
-                sprites_dict[f'{directory}_{state}_left'].append(pygame.transform.flip(sprite, True, False))
-    return sprites_dict, weapon_data
+            add_flipped(frames, f'{directory}_{state}',
+                        load_frames(os.path.join(path, directory, filename), sprite_width, sprite_height, scale))
+    return Atlas(frames)
+
+
+class RestingBody(Protocol):
+    # Правила падения и засыпания общие для Weapon и ServerWeapon, чтобы клиент и сервер совпадали
+    GRAVITY = 128
+    MAX_FALL_SPEED = 512
+    SLEEP_AFTER_STEPS = 10  # Сколько шагов тело лежит на земле, прежде чем заснуть
+    WAKE_DISTANCE = 32  # Изменения уровня ближе этого будят тело
+
+    vy: int
+    sleeping: bool
+    resting_steps: int
+
+    def shift_y(self, dy) -> None: ...
+
+    def get_center(self) -> tuple[int, int]: ...
+
+    def wake(self) -> None:
+        self.sleeping = False
+        self.resting_steps = 0
+
+    def fall(self, time_delta, level) -> None:
+        dy = int(time_delta * self.vy)
+        self.shift_y(dy)
+        if level.collide_point(*self.get_center()):
+            self.shift_y(-dy)
+            self.vy = 0
+            self.resting_steps += 1
+            if self.resting_steps >= RestingBody.SLEEP_AFTER_STEPS:
+                self.sleeping = True
+        else:
+            self.vy = min(self.vy + RestingBody.GRAVITY, RestingBody.MAX_FALL_SPEED)
+            if dy != 0:
+                self.resting_steps = 0
 
+    def wake_near(self, rects: list[pygame.Rect]) -> bool:
+        x, y = self.get_center()
+        for rect in rects:
+            if rect.inflate(2 * RestingBody.WAKE_DISTANCE, 2 * RestingBody.WAKE_DISTANCE).collidepoint(x, y):
+                self.wake()
+                return True
+        return False
 
-class Weapon:
-    all_weapons_sprites, all_weapons_info = load_weapon_sprites(1)
+
+class Weapon(RestingBody):
+    # Сервер и меню используют только конфиги, картинки грузятся при первом создании оружия
+    all_weapons_info = load_weapon_info()
+    all_weapons_sprites: Atlas = None
+    RAY_STEP = 4  # Не больше, чем пуля пролетала за шаг симуляции сервера
+
+    @staticmethod
+    def sprites() -> Atlas:
+        if Weapon.all_weapons_sprites is None:
+            Weapon.all_weapons_sprites = load_weapon_sprites(1, Weapon.all_weapons_info)
+        return Weapon.all_weapons_sprites
 
     def __init__(self, name, ammo=0, pos=None, owner=None):
         self.attached = False
@@ -63,6 +115,8 @@ class Weapon:
         self.sounds = load_weapon_sound(name)
 
         self.vy = 0
+        self.sleeping = False
+        self.resting_steps = 0
         if pos:
             self.direction = 'right'
             self.x = pos[0]
@@ -94,10 +148,13 @@ class Weapon:
     def attach(self, player):
         self.owner = player
         self.attached = True
+        self.wake()
+        self.update_sprite(0)  # Руки нужны уже в ближайшем кадре
 
     def detach(self):
         self.owner = None
         self.attached = False
+        self.wake()
 
     def shoot(self):
         if self.name == 'WeaponNone':
@@ -112,22 +169,49 @@ class Weapon:
         self.status = 'shoot'
         self.sprite_number = 0
 
-        spread = 0
-        if 'BULLETS_SPREAD' in Weapon.all_weapons_info[self.name].keys():
-            spread = Weapon.all_weapons_info[self.name]['BULLETS_SPREAD']
-
-        bullets_count = 1
-        if 'BULLETS_COUNT' in Weapon.all_weapons_info[self.name].keys():
-            bullets_count = Weapon.all_weapons_info[self.name]['BULLETS_COUNT']
+        # Разброс дробинок задаётся зерном, по нему сервер и клиенты получают одинаковый залп
+        return random.getrandbits(32)
 
-        bullets = []
+    @staticmethod
+    def volley_speeds(name: str, direction: str, seed: int) -> list[tuple[float, float]]:
+        info = Weapon.all_weapons_info[name]
+        spread = info.get('BULLETS_SPREAD', 0)
+        bullets_count = info.get('BULLETS_COUNT', 1)
+        speed = info['BULLET_SPEED']
+
+        rng = random.Random(seed)
+        speeds = []
         for _ in range(bullets_count):
-            speed = Weapon.all_weapons_info[self.name]['BULLET_SPEED']
-            speed_y = random.uniform(-spread, spread) * speed
-            speed_x = int((speed ** 2 - speed_y ** 2) ** 0.5) * (1 if self.direction == 'right' else -1)
-            ay = Weapon.all_weapons_info[self.name]['BULLET_Y_ACCELERATION']
-            bullets.append(Bullet(self.get_barrel_position(), (speed_x, speed_y), self.damage, ay))
-        return bullets
+            speed_y = rng.uniform(-spread, spread) * speed
+            speed_x = int((speed ** 2 - speed_y ** 2) ** 0.5) * (1 if direction == 'right' else -1)
+            speeds.append((speed_x, speed_y))
+        return speeds
+
+    @staticmethod
+    def volley(name: str, position: tuple[int, int], direction: str, seed: int) -> list[Bullet]:
+        info = Weapon.all_weapons_info[name]
+        return [Bullet(position, speed, info['BULLET_DAMAGE'], info['BULLET_Y_ACCELERATION'])
+                for speed in Weapon.volley_speeds(name, direction, seed)]
+
+    @staticmethod
+    def is_hitscan(name: str) -> bool:
+        return bool(Weapon.all_weapons_info[name].get('HITSCAN', False))
+
+    @staticmethod
+    def cast_ray(position: tuple[float, float], speed: tuple[float, float], level) -> tuple[float, float]:
+        # Луч идёт в направлении скорости на то расстояние, которое пуля пролетела бы за время жизни,
+        # и обрывается на первом твёрдом пикселе уровня
+        x, y = position
+        length = math.hypot(*speed)
+        if length == 0:
+            return x, y
+        dx, dy = speed[0] / length * Weapon.RAY_STEP, speed[1] / length * Weapon.RAY_STEP
+        for _ in range(int(length * Bullet.MAX_LIFETIME_SECONDS // Weapon.RAY_STEP)):
+            x += dx
+            y += dy
+            if level.collide_point(x, y):
+                break
+        return x, y
 
     def update(self, time_delta, level):
         time_delta = min(1 / 20, time_delta)
@@ -136,15 +220,10 @@ class Weapon:
             self.x = self.owner.rect.x + Weapon.all_weapons_info[self.name][f'OFFSET_X_{self.direction.upper()}']
             self.y = self.owner.rect.y + Weapon.all_weapons_info[self.name]['OFFSET_Y']
         else:
-            dvy = 128
-            dy = int(time_delta * self.vy)
-            self.y += dy
-            if level.collide_point(*self.get_center()):
-                self.y -= dy
-                self.vy = 0
-            else:
-                self.vy += dvy
-                self.vy = min(self.vy, 512)
+            self.fall(time_delta, level)
+
+    def shift_y(self, dy):
+        self.y += dy
 
     def update_sprite(self, time_delta):
         self.animation_switch_timer += time_delta
@@ -152,7 +231,7 @@ class Weapon:
             self.sprite_number += 1
 
             if self.sprite_number >= len(
-                    Weapon.all_weapons_sprites[f'{self.name}_{self.status}_{self.direction}']):
+                    Weapon.sprites()[f'{self.name}_{self.status}_{self.direction}']):
                 if self.status == 'shoot':
                     self.status = 'idle'
 
@@ -162,12 +241,12 @@ class Weapon:
 
         if self.attached:
             self.arms_sprite = \
-                Weapon.all_weapons_sprites[f'{self.name}_arms_{self.status}_{self.direction}'][self.sprite_number]
+                Weapon.sprites()[f'{self.name}_arms_{self.status}_{self.direction}'][self.sprite_number]
             self.weapon_sprite = \
-                Weapon.all_weapons_sprites[f'{self.name}_{self.status}_{self.direction}'][self.sprite_number]
+                Weapon.sprites()[f'{self.name}_{self.status}_{self.direction}'][self.sprite_number]
         else:
             self.weapon_sprite = \
-                Weapon.all_weapons_sprites[f'{self.name}_{self.status}_{self.direction}'][self.sprite_number]
+                Weapon.sprites()[f'{self.name}_{self.status}_{self.direction}'][self.sprite_number]
 
     def get_position(self):
         return self.x, self.y
@@ -211,13 +290,15 @@ class Weapon:
 
 
 class Bullet:
+    # Клиенты сами убирают пули по времени жизни и столкновению со стеной, сервер сообщает только о попаданиях
+    MAX_LIFETIME_SECONDS = 1
+
     def __init__(self, position, speed, damage, acceleration_y):
         self.damage = damage
         self.ay = acceleration_y
         self.x, self.y = position
         self.vx, self.vy = speed
-        self.image = pygame.surface.Surface((10, 10))
-        self.image.fill((255, 255, 255))
+        self.current_lifetime_seconds = 0
 
     def encode(self):
         return [(self.x, self.y), (self.vx, self.vy), self.damage, self.ay]
@@ -231,9 +312,34 @@ class Bullet:
 
     def update(self, time_delta):
         self.vy += self.ay
+        self.current_lifetime_seconds += time_delta
         dx, dy = self.vx * time_delta, self.vy * time_delta
         self.x += dx
         self.y += dy
 
+    def is_dead(self, level) -> bool:
+        return self.current_lifetime_seconds > Bullet.MAX_LIFETIME_SECONDS or bool(level.collide_point(self.x, self.y))
+
     def draw(self, screen: pygame.Surface, offset_x, offset_y):
         pygame.draw.circle(screen, (255, 255, 255), (self.x + offset_x, self.y + offset_y), 2)
+
+
+class Tracer:
+    # След луча hitscan-оружия, только для отрисовки
+    LIFETIME_SECONDS = 0.08
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.current_lifetime_seconds = 0
+
+    def update(self, time_delta):
+        self.current_lifetime_seconds += time_delta
+
+    def is_dead(self) -> bool:
+        return self.current_lifetime_seconds > Tracer.LIFETIME_SECONDS
+
+    def draw(self, screen: pygame.Surface, offset_x, offset_y):
+        start = (self.start[0] + offset_x, self.start[1] + offset_y)
+        end = (self.end[0] + offset_x, self.end[1] + offset_y)
+        pygame.draw.line(screen, (255, 255, 255), start, end)